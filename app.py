@@ -37,11 +37,12 @@ initialize_session_state(DB_FILE)
 st.title('Cytometry Data Analysis')
 
 # --- Data Fetching for Filters (runs early) ---
-projects = database.get_distinct_values(DB_FILE, 'project')
-conditions = database.get_distinct_values(DB_FILE, 'condition')
-treatments_db = database.get_distinct_values(DB_FILE, 'treatment')
+distinct_filter_values = database.get_distinct_values_bulk(DB_FILE, ('project', 'condition', 'treatment'))
+projects = distinct_filter_values['project']
+conditions = distinct_filter_values['condition']
+treatments_db = distinct_filter_values['treatment']
 responses_options = ['y', 'n', '']
-all_db_samples_ids = database.get_all_data(DB_FILE)['sample_id'].tolist()
+all_db_samples_ids = database.get_all_sample_ids(DB_FILE)
 
 
 
@@ -18,9 +18,17 @@ if not logger.hasHandlers():
     # logger.setLevel(logging.INFO) # Or logging.DEBUG for more verbosity
     pass # Let the application configure logging
 
+# Import connection helpers
+from .connection_manager import (
+    get_connection,
+    close_connections,
+    close_all_connections
+)
+
 # Import functions and constants from schema_manager to make them available at db_layer level
 from .schema_manager import (
     init_db,
+    create_secondary_indexes,
     EXPECTED_SAMPLE_COLUMNS,
     CSV_SAMPLE_ID_COLUMN,
     EXPECTED_CELL_POPULATIONS
@@ -41,12 +49,15 @@ from .crud_ops import (
 # Import functions from query_executor
 from .query_executor import (
     get_distinct_values,
+    get_distinct_values_bulk,
     get_filtered_data,
     get_all_data,
     get_data_for_frequency_table,
     get_data_for_treatment_response_analysis,
     get_data_for_baseline_analysis,
     get_data_for_custom_baseline_query, # Added for custom query
+    get_analysis_bundle,
+    get_all_sample_ids,
     get_all_sample_ids_from_samples_table
 )
 
@@ -62,8 +73,13 @@ from .admin_manager import (
 # You can define an __all__ list if you want to specify what `from db_layer import *` imports
 # This is good practice.
 __all__ = [
+    # connection_manager
+    'get_connection',
+    'close_connections',
+    'close_all_connections',
     # schema_manager
     'init_db',
+    'create_secondary_indexes',
     'EXPECTED_SAMPLE_COLUMNS',
     'CSV_SAMPLE_ID_COLUMN',
     'EXPECTED_CELL_POPULATIONS',
@@ -75,12 +91,15 @@ __all__ = [
     'remove_sample',
     # query_executor
     'get_distinct_values',
+    'get_distinct_values_bulk',
     'get_filtered_data',
     'get_all_data',
     'get_data_for_frequency_table',
     'get_data_for_treatment_response_analysis',
     'get_data_for_baseline_analysis',
     'get_data_for_custom_baseline_query',
+    'get_analysis_bundle',
+    'get_all_sample_ids',
     'get_all_sample_ids_from_samples_table', # Ensure all query_executor functions are listed
     # admin_manager
     'log_operation',
@@ -3,53 +3,139 @@ import pandas as pd
 import logging
 import json
 from datetime import datetime
-import shutil
 import os
+import time
+import zlib
+import streamlit as st
+
+from .connection_manager import connect, get_connection
 
 logger = logging.getLogger(__name__)
 
+INSERT_OPERATION_LOG_SQL = '''
+    INSERT INTO operation_log (timestamp, operation_type, sample_id, details)
+    VALUES (?, ?, ?, ?)
+'''
+
+# JSON details longer than this are stored zlib-compressed as a BLOB, prefixed with DETAILS_ZLIB_MAGIC
+DETAILS_COMPRESS_MIN_SIZE = 256
+DETAILS_ZLIB_MAGIC = b'Z\x01'
+
+def _encode_details(details_json):
+    if len(details_json) <= DETAILS_COMPRESS_MIN_SIZE:
+        return details_json
+    return DETAILS_ZLIB_MAGIC + zlib.compress(details_json.encode('utf-8'), 3)
+
+def _decode_details(details):
+    if isinstance(details, bytes) and details.startswith(DETAILS_ZLIB_MAGIC):
+        return zlib.decompress(details[len(DETAILS_ZLIB_MAGIC):]).decode('utf-8')
+    return details
+
+def _operation_log_row(operation_type, sample_id=None, details=None):
+    # time.strftime formats the C struct_tm directly, without building a datetime object per entry
+    timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(details, dict):
+        details_json = _encode_details(json.dumps(details))
+    else:
+        details_json = str(details) # Fallback if details is not a dict
+    return (timestamp, operation_type, sample_id, details_json)
+
+def write_operation_log_entry(cursor, operation_type, sample_id=None, details=None):
+    """Inserts an operation_log row using the caller's cursor, inside the caller's transaction."""
+    cursor.execute(INSERT_OPERATION_LOG_SQL, _operation_log_row(operation_type, sample_id, details))
+
 def log_operation(db_file, operation_type, sample_id=None, details=None):
-    conn = sqlite3.connect(db_file)
+    """Records an operation in operation_log in its own transaction."""
+    conn = get_connection(db_file)
     c = conn.cursor()
     try:
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        if isinstance(details, dict):
-            details_json = json.dumps(details)
-        else:
-            details_json = str(details) # Fallback if details is not a dict
-
-        c.execute('''
-            INSERT INTO operation_log (timestamp, operation_type, sample_id, details)
-            VALUES (?, ?, ?, ?)
-        ''', (timestamp, operation_type, sample_id, details_json))
+        write_operation_log_entry(c, operation_type, sample_id=sample_id, details=details)
         conn.commit()
         logger.info(f"Logged operation: {operation_type} for sample_id: {sample_id}")
     except Exception as e:
         logger.error(f"Error logging operation: {e}")
-        # Potentially rollback, but logging failure shouldn't stop main ops
-    finally:
-        conn.close()
+        # Logging failure shouldn't stop main ops, but don't leave the shared connection mid-transaction
+        conn.rollback()
+
+def _try_parse_json(data):
+    # Entries without details are stored as the text 'None'; only attempt a parse on JSON objects/arrays
+    # so those rows don't pay for a raised and caught JSONDecodeError
+    if isinstance(data, str) and data[:1] in ('{', '['):
+        try:
+            return json.loads(data)
+        except json.JSONDecodeError:
+            return data # Return as is if not valid JSON
+    return data
 
+# The log only changes on writes; the UI clears this cache after each one, and the TTL covers writes made elsewhere
+@st.cache_data(ttl=300, show_spinner=False)
 def get_operation_log(db_file, limit=50):
-    conn = sqlite3.connect(db_file)
+    conn = get_connection(db_file)
     try:
-        query = f"SELECT timestamp, operation_type, sample_id, details FROM operation_log ORDER BY timestamp DESC LIMIT {limit}"
-        df = pd.read_sql_query(query, conn)
-        
-        def try_parse_json(data):
-            if isinstance(data, str):
-                try:
-                    return json.loads(data)
-                except json.JSONDecodeError:
-                    return data # Return as is if not valid JSON
-            return data
-
-        if 'details' in df.columns:
-            df['details'] = df['details'].apply(try_parse_json)
-        return df
+        # LIMIT is bound rather than interpolated so every call reuses one cached statement
+        query = "SELECT timestamp, operation_type, sample_id, details FROM operation_log ORDER BY timestamp DESC LIMIT ?"
+        # Decode 'details' while materializing the rows rather than via a per-row Series.apply afterwards
+        rows = [(timestamp, operation_type, sample_id, _try_parse_json(_decode_details(details)))
+                for timestamp, operation_type, sample_id, details in conn.execute(query, (int(limit),))]
+        return pd.DataFrame.from_records(rows, columns=['timestamp', 'operation_type', 'sample_id', 'details'])
+    except sqlite3.OperationalError as e:
+        # e.g. operation_log does not exist yet; query directly and fall back here instead of checking sqlite_master first
+        logger.warning(f"Operation log not available: {e}")
+        return pd.DataFrame(columns=['timestamp', 'operation_type', 'sample_id', 'details'])
     except Exception as e:
         logger.error(f"Error fetching operation log: {e}")
         return pd.DataFrame() # Return empty DataFrame on error
+
+def _backup_database(source_db_file, target_db_file, pages=4096):
+    """Copies source_db_file into target_db_file with SQLite's online backup API and returns the number of pages copied."""
+    page_counts = {'total': 0}
+
+    def track_progress(status, remaining, total):
+        page_counts['total'] = total
+        logger.debug(f"_backup_database: {total - remaining}/{total} pages copied to {target_db_file}")
+
+    source = sqlite3.connect(source_db_file)
+    target = sqlite3.connect(target_db_file)
+    try:
+        with target:
+            source.backup(target, pages=pages, progress=track_progress)
+    finally:
+        target.close()
+        source.close()
+    return page_counts['total']
+
+# Linux ioctl that makes the destination share the source file's extents (a copy-on-write reflink)
+FICLONE = 0x40049409
+
+def _reflink_database(source_db_file, target_db_file):
+    """
+    Clones source_db_file into target_db_file as a copy-on-write reflink, which moves no data on
+    filesystems that support it (btrfs, XFS). Returns False when the clone is not possible.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        return False # Not a POSIX platform
+
+    conn = connect(source_db_file)
+    try:
+        # Flush the WAL into the main file, then hold the write lock so nothing lands in it while cloning
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            wal_file = source_db_file + '-wal'
+            if os.path.exists(wal_file) and os.path.getsize(wal_file) > 0:
+                return False # A reader kept the WAL from being truncated; the main file alone is not a complete copy
+            with open(source_db_file, 'rb') as source, open(target_db_file, 'wb') as target:
+                fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+            return True
+        except OSError as e:
+            logger.debug(f"_reflink_database: Reflink not available for {target_db_file}: {e}")
+            if os.path.exists(target_db_file):
+                os.remove(target_db_file)
+            return False
+        finally:
+            conn.rollback()
     finally:
         conn.close()
 
@@ -63,8 +149,12 @@ def create_db_checkpoint(db_file, checkpoint_dir="checkpoints"):
     checkpoint_path = os.path.join(checkpoint_dir, checkpoint_name)
 
     try:
-        shutil.copy2(db_file, checkpoint_path)
-        logger.info(f"Database checkpoint created: {checkpoint_path}")
+        # A hardlink would share later writes with the checkpoint, so the zero-copy path is a reflink only
+        if _reflink_database(db_file, checkpoint_path):
+            logger.info(f"Database checkpoint created: {checkpoint_path} (reflink)")
+        else:
+            page_count = _backup_database(db_file, checkpoint_path)
+            logger.info(f"Database checkpoint created: {checkpoint_path} (backup API, {page_count} pages)")
         log_operation(db_file, 'create_checkpoint', details={'checkpoint_path': checkpoint_path})
         return checkpoint_path
     except Exception as e:
@@ -77,15 +167,15 @@ def list_db_checkpoints(db_file, checkpoint_dir="checkpoints"):
         return []
     
     try:
-        checkpoint_files = []
-        for f_name in os.listdir(checkpoint_dir):
-            if f_name.startswith('db_checkpoint_') and f_name.endswith('.db'):
-                full_path = os.path.join(checkpoint_dir, f_name)
-                checkpoint_files.append(full_path)
+        # DirEntry caches its stat result, so each file is stat'ed once for both the type check and the mtime
+        with os.scandir(checkpoint_dir) as entries:
+            checkpoints = [(entry.stat(follow_symlinks=False).st_mtime, entry.path) for entry in entries
+                           if entry.name.startswith('db_checkpoint_') and entry.name.endswith('.db')
+                           and entry.is_file(follow_symlinks=False)]
         
-        # Sort by modification time, newest first
-        checkpoint_files.sort(key=lambda f_path: os.path.getmtime(f_path), reverse=True)
-        return checkpoint_files
+        # Sort by modification time, newest first (the timestamped name breaks ties)
+        checkpoints.sort(reverse=True)
+        return [path for _, path in checkpoints]
     except Exception as e:
         logger.error(f"Error listing database checkpoints: {e}")
         return []
@@ -96,11 +186,16 @@ def revert_to_db_checkpoint(current_db_file, checkpoint_db_file):
         return False, "Checkpoint file not found."
     
     try:
-        # It's safer to copy the checkpoint over the current DB file
-        # than to rename, to avoid data loss if something goes wrong.
-        # Ensure current_db_file path is valid and we have write permissions.
-        shutil.copy2(checkpoint_db_file, current_db_file)
-        logger.info(f"Database successfully reverted from checkpoint '{checkpoint_db_file}' to '{current_db_file}'.")
+        # Restore through the backup API rather than copying the file, so the
+        # pages are replaced under SQLite's locks and open connections stay valid.
+        page_count = _backup_database(checkpoint_db_file, current_db_file)
+        # Under WAL the restored pages land in the -wal file first; fold them into the database file and truncate the WAL
+        conn = connect(current_db_file)
+        try:
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        finally:
+            conn.close()
+        logger.info(f"Database successfully reverted from checkpoint '{checkpoint_db_file}' to '{current_db_file}' ({page_count} pages).")
         log_operation(current_db_file, 'revert_checkpoint', details={'reverted_from': checkpoint_db_file})
         return True, f"Database successfully reverted from {os.path.basename(checkpoint_db_file)}."
     except Exception as e:
@@ -0,0 +1,120 @@
+import atexit
+import os
+import sqlite3
+import threading
+import weakref
+import logging
+
+logger = logging.getLogger(__name__)
+
+# WAL lets readers proceed during writes and avoids the rollback-journal double write;
+# set CYTOMETRY_SQLITE_WAL=0 where the database lives on storage that cannot share WAL files.
+USE_WAL = os.getenv('CYTOMETRY_SQLITE_WAL', '1') != '0'
+
+CONNECTION_PRAGMAS = [
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -65536',
+    'PRAGMA mmap_size = 268435456',
+    # Long-lived connections wait for a competing writer instead of failing with "database is locked"
+    'PRAGMA busy_timeout = 5000',
+    # Enforce cell_counts -> samples, so deleting a sample cascades to its cell counts
+    'PRAGMA foreign_keys = ON',
+]
+
+def connect(db_file, check_same_thread=True):
+    """Opens a new connection to db_file with the application's PRAGMAs applied."""
+    # A larger statement cache keeps the prepared INSERT/SELECT statements of the load and query paths compiled
+    conn = sqlite3.connect(db_file, cached_statements=512, check_same_thread=check_same_thread)
+    if USE_WAL:
+        conn.execute('PRAGMA journal_mode = WAL')
+    for pragma in CONNECTION_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+# Streamlit runs every script run on a new thread, so a thread only holds its connections for one run.
+# A thread checks connections out exclusively (its transactions never interleave with another thread's);
+# when the thread ends they go back to a process-wide idle pool, and the next run reuses them with their
+# PRAGMAs, page cache and prepared statements intact instead of reconnecting.
+_pool_lock = threading.Lock()
+_idle_connections = {}  # db_file -> connections released by finished threads
+_open_connections = []  # (db_file, connection) for every pooled connection, so exit can close them all
+_thread_local = threading.local()
+
+class _ThreadConnections:
+    """Holds one thread's checked-out connections; its finalizer runs when the thread's locals are cleared."""
+    def __init__(self):
+        self.connections = {}
+        weakref.finalize(self, _release_connections, self.connections)
+
+def _release_connections(connections):
+    for db_file, conn in connections.items():
+        with _pool_lock:
+            still_open = any(entry[1] is conn for entry in _open_connections)
+        if not still_open:
+            continue  # Already closed by close_all_connections at exit
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error as e:
+            logger.warning(f"_release_connections: Discarding connection to {db_file}: {e}")
+            _close(db_file, conn)
+            continue
+        with _pool_lock:
+            _idle_connections.setdefault(db_file, []).append(conn)
+    connections.clear()
+
+def _close(db_file, conn):
+    with _pool_lock:
+        _open_connections[:] = [entry for entry in _open_connections if entry[1] is not conn]
+    try:
+        conn.close()
+    except Exception as e:
+        logger.warning(f"close_connections: Error closing connection to {db_file}: {e}")
+
+def _thread_connections():
+    holder = getattr(_thread_local, 'holder', None)
+    if holder is None:
+        holder = _thread_local.holder = _ThreadConnections()
+    return holder.connections
+
+def get_connection(db_file):
+    """
+    Returns the calling thread's connection to db_file: an idle pooled connection left by an earlier
+    script run if there is one, otherwise a new one. The thread keeps it until it ends.
+    """
+    connections = _thread_connections()
+    conn = connections.get(db_file)
+    if conn is None:
+        with _pool_lock:
+            idle = _idle_connections.get(db_file)
+            conn = idle.pop() if idle else None
+        if conn is None:
+            # Used by one thread at a time, but by different threads over its lifetime
+            conn = connect(db_file, check_same_thread=False)
+            with _pool_lock:
+                _open_connections.append((db_file, conn))
+            logger.info(f"get_connection: Opened connection to {db_file} for thread {threading.current_thread().name}.")
+        connections[db_file] = conn
+    return conn
+
+def close_connections():
+    """Closes the connections checked out by the calling thread."""
+    connections = _thread_connections()
+    for db_file, conn in list(connections.items()):
+        _close(db_file, conn)
+    connections.clear()
+
+def close_all_connections():
+    """Closes every pooled connection of the process, idle or checked out; registered to run at exit."""
+    with _pool_lock:
+        open_connections = list(_open_connections)
+        _open_connections.clear()
+        _idle_connections.clear()
+    for db_file, conn in open_connections:
+        try:
+            conn.close()
+        except Exception as e:
+            logger.warning(f"close_all_connections: Error closing connection to {db_file}: {e}")
+
+atexit.register(close_all_connections)
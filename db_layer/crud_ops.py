@@ -1,15 +1,27 @@
 import sqlite3
 import logging
-from uuid import uuid4
-import pandas as pd # For pd.notna in add_sample
+import pandas as pd # For vectorized cell count validation in add_sample
 
-# Assuming admin_manager.py will be in the same directory for log_operation
-from .admin_manager import log_operation
+# Assuming admin_manager.py will be in the same directory for write_operation_log_entry
+from .admin_manager import write_operation_log_entry
+from .connection_manager import get_connection
 
 logger = logging.getLogger(__name__)
 
+# Statements are kept as module constants so every call issues the identical SQL text and hits the connection's statement cache
+INSERT_SAMPLE_SQL = '''
+    INSERT INTO samples (
+        sample_id, project, subject, condition, age, sex, 
+        treatment, response, sample_type, time_from_treatment_start
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+INSERT_CELL_COUNT_SQL = '''
+    INSERT INTO cell_counts (sample_id, population, count)
+    VALUES (?, ?, ?)
+'''
+
 def add_sample(db_file, sample_data):
-    conn = sqlite3.connect(db_file)
+    conn = get_connection(db_file)
     c = conn.cursor()
     try:
         sample_id = sample_data.get('sample_id')
@@ -32,12 +44,7 @@ def add_sample(db_file, sample_data):
             logger.warning(f"add_sample: Invalid time_from_treatment_start value '{sample_data.get('time_from_treatment_start')}' for sample '{sample_id}'. Storing as NULL.")
             time_from_treatment_start = None
 
-        c.execute('''
-            INSERT INTO samples (
-                sample_id, project, subject, condition, age, sex, 
-                treatment, response, sample_type, time_from_treatment_start
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
+        c.execute(INSERT_SAMPLE_SQL, (
             sample_id, 
             sample_data.get('project'), 
             sample_data.get('subject'),
@@ -52,23 +59,22 @@ def add_sample(db_file, sample_data):
         logger.info(f"add_sample: Inserted sample '{sample_id}' into 'samples' table.")
 
         if 'cell_counts' in sample_data and isinstance(sample_data['cell_counts'], dict):
-            for pop, count_val in sample_data['cell_counts'].items():
-                try:
-                    count = int(count_val)
-                    if count < 0:
-                        logger.warning(f"add_sample: Invalid cell count ({count}) for sample '{sample_id}', population '{pop}'. Skipping this cell count entry.")
-                        continue
-                    c.execute('''
-                        INSERT INTO cell_counts (id, sample_id, population, count)
-                        VALUES (?, ?, ?, ?)
-                    ''', (str(uuid4()), sample_id, pop, count))
-                    logger.debug(f"add_sample: Inserted cell count for sample '{sample_id}', population '{pop}'.")
-                except ValueError:
-                    logger.warning(f"add_sample: Invalid cell count value ('{count_val}') for sample '{sample_id}', population '{pop}'. Skipping this cell count entry.")
-                    continue
+            raw_counts = pd.Series(sample_data['cell_counts'], dtype=object)
+            counts = pd.to_numeric(raw_counts, errors='coerce')
+            invalid_mask = counts.isna()
+            negative_mask = counts < 0
+            if invalid_mask.any():
+                logger.warning(f"add_sample: Invalid cell count value(s) {raw_counts[invalid_mask].to_dict()} for sample '{sample_id}'. Skipping these cell count entries.")
+            if negative_mask.any():
+                logger.warning(f"add_sample: Negative cell count(s) {counts[negative_mask].to_dict()} for sample '{sample_id}'. Skipping these cell count entries.")
+            valid_counts = counts[~(invalid_mask | negative_mask)].astype('int64')
+            cell_count_rows = [(sample_id, pop, count) for pop, count in zip(valid_counts.index, valid_counts.tolist())]
+            c.executemany(INSERT_CELL_COUNT_SQL, cell_count_rows)
+            logger.debug("add_sample: Inserted %d cell counts for sample '%s'.", len(cell_count_rows), sample_id)
+        # Log on the same connection so the insert and its log entry commit together
+        write_operation_log_entry(c, 'add_sample', sample_id=sample_id, details={'data': sample_data})
         conn.commit()
         logger.info(f"add_sample: Successfully added sample '{sample_id}' and its cell counts.")
-        log_operation(db_file, 'add_sample', sample_id=sample_id, details={'data': sample_data})
         return True, f"Sample {sample_id} added successfully."
     except sqlite3.IntegrityError as e:
         conn.rollback()
@@ -78,33 +84,31 @@ def add_sample(db_file, sample_data):
         conn.rollback()
         logger.error(f"add_sample: An unexpected error occurred while adding sample '{sample_id}': {e}")
         return False, f"An unexpected error occurred while adding sample '{sample_id}'."
-    finally:
-        conn.close()
 
 def remove_sample(db_file, sample_id):
-    conn = sqlite3.connect(db_file)
+    conn = get_connection(db_file)
     c = conn.cursor()
     try:
-        # First, delete associated cell counts
-        c.execute('DELETE FROM cell_counts WHERE sample_id = ?', (sample_id,))
-        logger.info(f"remove_sample: Deleted cell counts for sample_id '{sample_id}'.")
-        
-        # Then, delete the sample itself
-        c.execute('DELETE FROM samples WHERE sample_id = ?', (sample_id,))
-        logger.info(f"remove_sample: Deleted sample with sample_id '{sample_id}'.")
+        try:
+            # cell_counts rows are removed by the ON DELETE CASCADE foreign key (enforced on every connection)
+            c.execute('DELETE FROM samples WHERE sample_id = ?', (sample_id,))
+        except sqlite3.IntegrityError:
+            # Databases created before the cascading foreign key need the cell counts removed first
+            c.execute('DELETE FROM cell_counts WHERE sample_id = ?', (sample_id,))
+            c.execute('DELETE FROM samples WHERE sample_id = ?', (sample_id,))
         
         if c.rowcount == 0:
             logger.warning(f"remove_sample: No sample found with sample_id '{sample_id}' to delete.")
             conn.rollback() # Rollback if no sample was deleted
             return False, f"No sample found with ID {sample_id}."
+        logger.info(f"remove_sample: Deleted sample with sample_id '{sample_id}' and its cell counts.")
 
+        # Log on the same connection so the delete and its log entry commit together
+        write_operation_log_entry(c, 'remove_sample', sample_id=sample_id)
         conn.commit()
         logger.info(f"remove_sample: Successfully removed sample '{sample_id}'.")
-        log_operation(db_file, 'remove_sample', sample_id=sample_id)
         return True, f"Sample {sample_id} removed successfully."
     except Exception as e:
         conn.rollback()
         logger.error(f"remove_sample: Error removing sample '{sample_id}': {e}")
         return False, f"Error removing sample {sample_id}: {e}"
-    finally:
-        conn.close()
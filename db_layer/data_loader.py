@@ -1,19 +1,187 @@
+import csv
 import os
-import sqlite3
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 import logging
-from uuid import uuid4
 import json
 from datetime import datetime
 from reporting_tools.cache_manager import cache_dataframe, get_cached_dataframe, invalidate_cache
 
 # Assuming admin_manager.py will be in the same directory for log_operation
-from .admin_manager import log_operation 
+from .admin_manager import log_operation
+from .connection_manager import connect, get_connection
 # Assuming schema_manager.py will be in the same directory for constants
-from .schema_manager import CSV_SAMPLE_ID_COLUMN, EXPECTED_CELL_POPULATIONS, EXPECTED_SAMPLE_COLUMNS
+from .schema_manager import CSV_SAMPLE_ID_COLUMN, EXPECTED_CELL_POPULATIONS, EXPECTED_SAMPLE_COLUMNS, create_secondary_indexes
 
 logger = logging.getLogger(__name__)
 
+# Parsed chunks buffered between the CSV parser and the append writer thread
+APPEND_QUEUE_MAXSIZE = 64
+# Queue sentinel telling the append writer to roll back instead of committing
+ABORT_APPEND = object()
+
+# pyarrow is optional: when installed, CSVs are streamed through its multi-threaded reader
+try:
+    import pyarrow as pa
+    from pyarrow import csv as pa_csv
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# Built once so the append loop reuses one SQL string (and its cached prepared statement) for every row
+APPEND_SAMPLE_SQL = f'''
+    INSERT OR IGNORE INTO samples ({', '.join(EXPECTED_SAMPLE_COLUMNS)})
+    VALUES ({', '.join(['?'] * len(EXPECTED_SAMPLE_COLUMNS))})
+'''
+APPEND_CELL_COUNT_SQL = '''
+    INSERT OR IGNORE INTO cell_counts (sample_id, population, count)
+    VALUES (?, ?, ?)
+'''
+LOAD_SAMPLE_SQL = f'''
+    INSERT OR REPLACE INTO samples ({', '.join(EXPECTED_SAMPLE_COLUMNS)})
+    VALUES ({', '.join(['?'] * len(EXPECTED_SAMPLE_COLUMNS))})
+'''
+LOAD_CELL_COUNT_SQL = '''
+    INSERT OR REPLACE INTO cell_counts (sample_id, population, count)
+    VALUES (?, ?, ?)
+'''
+
+def _csv_header(source):
+    """Returns the column names on the first line of source (a path or a seekable file object) without consuming it."""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, newline='', encoding='utf-8-sig') as f:
+            first_line = f.readline()
+    else:
+        start = source.tell()
+        first_line = source.readline()
+        source.seek(start)
+        if isinstance(first_line, bytes):
+            first_line = first_line.decode('utf-8-sig')
+    return next(csv.reader([first_line]), [])
+
+def _read_arrow_csv_chunks(source, chunk_size):
+    """Streams the CSV through pyarrow's block reader and re-slices its record batches into chunk_size-row DataFrames."""
+    column_names = _csv_header(source)
+    if not column_names:
+        raise pd.errors.EmptyDataError("No columns to parse from file")
+    # Every column as non-null strings, as pandas reads them with na_filter=False: blanks stay '' and
+    # literal 'NA'/'null'/'N/A' metadata is kept as text; _build_sample_rows and _build_cell_count_rows parse the numbers
+    convert_options = pa_csv.ConvertOptions(column_types={name: pa.string() for name in column_names},
+                                            strings_can_be_null=False)
+    try:
+        reader = pa_csv.open_csv(source, convert_options=convert_options)
+    except pa.ArrowInvalid as e:
+        if 'Empty CSV file' in str(e):
+            raise pd.errors.EmptyDataError(str(e)) from e
+        raise
+    pending = None
+    for batch in reader:
+        batch_df = batch.to_pandas()
+        pending = batch_df if pending is None else pd.concat([pending, batch_df], ignore_index=True)
+        while len(pending) >= chunk_size:
+            yield pending.iloc[:chunk_size]
+            pending = pending.iloc[chunk_size:]
+    if pending is not None and len(pending):
+        yield pending
+
+def _read_csv_chunks(source, chunk_size):
+    """Yields the CSV in DataFrame chunks of chunk_size rows, with missing values read as empty strings."""
+    if HAS_PYARROW:
+        # Only one block (plus a partial chunk) is held at a time, so reads stay bounded and overlap with inserts
+        yield from _read_arrow_csv_chunks(source, chunk_size)
+    else:
+        yield from pd.read_csv(source, chunksize=chunk_size, na_filter=False)
+
+def _prefetched(chunks):
+    """
+    Yields the items of the chunks iterator while a worker thread already reads the next one, so reading and
+    parsing the CSV overlaps with inserting the previous chunk (both pandas' parser and sqlite3 release the GIL).
+    """
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='csv_prefetch') as executor:
+        future = executor.submit(next, chunks, None)
+        while True:
+            chunk = future.result()
+            if chunk is None:
+                return
+            future = executor.submit(next, chunks, None)
+            yield chunk
+
+def _to_nullable_ints(values):
+    """Converts a numeric Series to plain Python ints (truncated like int()) with None for NaN, ready for sqlite3 binding."""
+    return [None if pd.isna(value) else int(value) for value in np.trunc(values).tolist()]
+
+def _rows_with_sample_id(chunk_df, log_prefix):
+    """
+    Returns (rows of chunk_df with a non-empty sample_id, stripped; number of rows skipped).
+    Expects the CSV sample id column to have been renamed to 'sample_id' already.
+    """
+    if 'sample_id' in chunk_df.columns:
+        chunk_sample_ids = chunk_df['sample_id'].astype(str).str.strip()
+    else:
+        chunk_sample_ids = pd.Series("", index=chunk_df.index)
+    has_sample_id = chunk_sample_ids != ""
+    missing_id_count = int((~has_sample_id).sum())
+    if missing_id_count:
+        logger.warning(f"{log_prefix}: Skipping {missing_id_count} row(s) in chunk due to missing or empty sample_id.")
+    return chunk_df[has_sample_id].assign(sample_id=chunk_sample_ids[has_sample_id]), missing_id_count
+
+def _build_sample_rows(samples_df, log_prefix):
+    """
+    Returns one tuple per row of samples_df in EXPECTED_SAMPLE_COLUMNS order. Empty or missing
+    metadata becomes NULL, non-numeric age/time_from_treatment_start become NULL, condition is lowercased.
+    """
+    columns = []
+    for db_col_name in EXPECTED_SAMPLE_COLUMNS:
+        # Assume CSV column name is the same as DB column name for metadata
+        if db_col_name not in samples_df.columns:
+            columns.append([None] * len(samples_df))
+            continue
+        if db_col_name in ('age', 'time_from_treatment_start') and pd.api.types.is_numeric_dtype(samples_df[db_col_name]):
+            # Already parsed as numbers by the CSV reader: skip the str/strip/to_numeric round-trip
+            columns.append(_to_nullable_ints(samples_df[db_col_name]))
+            continue
+        values = samples_df[db_col_name].astype(str).str.strip()
+        if db_col_name in ('age', 'time_from_treatment_start'):
+            numeric_values = pd.to_numeric(values, errors='coerce')
+            invalid_mask = numeric_values.isna() & (values != "")
+            if invalid_mask.any():
+                logger.warning(f"{log_prefix}: {int(invalid_mask.sum())} invalid {db_col_name} value(s) stored as NULL: {values[invalid_mask].unique().tolist()}")
+            columns.append(_to_nullable_ints(numeric_values))
+        else:
+            if db_col_name == 'condition':
+                values = values.str.lower()
+            columns.append([value if value != "" else None for value in values.tolist()])
+    return list(zip(*columns))
+
+def _build_cell_count_rows(samples_df, population_columns, log_prefix):
+    """
+    Melts the population columns of samples_df into (sample_id, population, count) rows.
+    Empty, non-numeric and negative counts become NULL, as in the per-cell parsing this replaces.
+    """
+    if samples_df.empty or not population_columns:
+        return []
+    long_df = samples_df.melt(id_vars=['sample_id'], value_vars=population_columns,
+                              var_name='population', value_name='raw_count')
+    if pd.api.types.is_numeric_dtype(long_df['raw_count']):
+        # Every population column was parsed as numbers by the CSV reader: skip the str/strip/to_numeric round-trip
+        counts = long_df['raw_count']
+    else:
+        raw_counts = long_df['raw_count'].astype(str).str.strip()
+        counts = pd.to_numeric(raw_counts, errors='coerce')
+        invalid_mask = counts.isna() & (raw_counts != "")
+        if invalid_mask.any():
+            logger.warning(f"{log_prefix}: {int(invalid_mask.sum())} invalid cell count value(s) stored as NULL: {raw_counts[invalid_mask].unique().tolist()}")
+
+    negative_mask = counts < 0
+    if negative_mask.any():
+        logger.warning(f"{log_prefix}: {int(negative_mask.sum())} negative cell count(s) stored as NULL.")
+
+    count_values = _to_nullable_ints(counts.where(~negative_mask))
+    return list(zip(long_df['sample_id'].tolist(), long_df['population'].tolist(), count_values))
+
 def load_csv_to_db(db_file, csv_file, chunk_size=1000):
     # Use CSV file's last modified time in the cache key
     csv_mtime = os.path.getmtime(csv_file)
@@ -21,15 +189,12 @@ def load_csv_to_db(db_file, csv_file, chunk_size=1000):
     cached_df = get_cached_dataframe(cache_key)
     # Validate cached DataFrame
     if cached_df is not None and 'sample_id' in cached_df.columns and not cached_df.empty:
-        # Double-check DB is populated
-        conn = sqlite3.connect(db_file)
+        # Double-check DB is populated, on this thread's shared connection rather than a new one per call
         try:
-            count = conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+            count = get_connection(db_file).execute("SELECT COUNT(*) FROM samples").fetchone()[0]
         except Exception as e:
             logger.warning(f"load_csv_to_db: Could not check DB population: {e}. Forcing reload from CSV.")
             count = 0
-        finally:
-            conn.close()
         if count > 0:
             logger.info(f"load_csv_to_db: Using valid cached data for {csv_file} and DB is populated ({count} samples).")
             return cached_df
@@ -40,98 +205,115 @@ def load_csv_to_db(db_file, csv_file, chunk_size=1000):
         logger.info("load_csv_to_db: Cache miss or invalid cache, loading from CSV.")
 
     # Open DB connection synchronously
-    conn = sqlite3.connect(db_file)
-    c = conn.cursor()
-
-    csv_df = pd.read_csv(csv_file, na_filter=False)
-    if CSV_SAMPLE_ID_COLUMN != 'sample_id' and CSV_SAMPLE_ID_COLUMN in csv_df.columns:
-        csv_df = csv_df.rename(columns={CSV_SAMPLE_ID_COLUMN: 'sample_id'})
-        logger.info(f"load_csv_to_db: Loading CSV '{csv_file}' in chunks of {chunk_size}.")
-        start_time = datetime.now()
-        
-        processed_rows = 0
-        chunks = pd.read_csv(csv_file, chunksize=chunk_size, na_filter=False)
-        for chunk_df in chunks:
-            logger.info(f"load_csv_to_db: Processing chunk {processed_rows // chunk_size + 1} with {len(chunk_df)} rows.")
-        for _, row in chunk_df.iterrows():
-            try:
-                sample_id_val = str(row[CSV_SAMPLE_ID_COLUMN]).strip() if CSV_SAMPLE_ID_COLUMN in row and str(row[CSV_SAMPLE_ID_COLUMN]).strip() != "" else None
-                logger.info(f"load_csv_to_db: Processing row with CSV sample value: '{row.get(CSV_SAMPLE_ID_COLUMN)}', parsed as sample_id: '{sample_id_val}'")
-                # Cache individual chunks for faster future processing
-                chunk_cache_key = f"csv_chunk:{csv_file}:{processed_rows // chunk_size}"
-                cache_dataframe(chunk_df, chunk_cache_key, expire_seconds=3600)
-                if not sample_id_val:
-                    logger.warning(f"load_csv_to_db: Skipping row due to missing or empty sample_id. Original CSV value: '{row.get(CSV_SAMPLE_ID_COLUMN)}'. Row data: {row.to_dict()}")
-                    continue
-                sample_id = sample_id_val # Use the validated and stripped sample_id
-
-                try:
-                    age = pd.to_numeric(row['age'], errors='coerce')
-                    time_from_treatment_start = pd.to_numeric(row['time_from_treatment_start'], errors='coerce')
-                except Exception as e:
-                    logger.warning(f"load_csv_to_db: Error converting age/time for sample {sample_id}: {e}. Skipping sample.")
-                    continue
-
-                c.execute('''
-                    INSERT OR REPLACE INTO samples (
-                        sample_id, project, subject, condition, age, sex,
-                        treatment, response, sample_type, time_from_treatment_start
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (
-                    sample_id, 
-                    str(row['project']).strip() if pd.notna(row['project']) else None,
-                    str(row['subject']).strip() if pd.notna(row['subject']) else None, 
-                    str(row['condition']).strip().lower() if pd.notna(row['condition']) else None, 
-                    None if pd.isna(age) else int(age), 
-                    str(row['sex']).strip() if pd.notna(row['sex']) else None, 
-                    str(row['treatment']).strip() if pd.notna(row['treatment']) else None, 
-                    str(row['response']).strip() if pd.notna(row['response']) else None, 
-                    str(row['sample_type']).strip() if pd.notna(row['sample_type']) else None, 
-                    None if pd.isna(time_from_treatment_start) else int(time_from_treatment_start)
-                ))
-                
-                for pop_col_name in EXPECTED_CELL_POPULATIONS:
-                    count_to_insert = None # Default to NULL
-                    if pop_col_name in row: # Check if column exists in CSV row
-                        cell_count_value_str = str(row[pop_col_name]).strip()
-                        if cell_count_value_str != "": # If CSV cell count is not an empty string, try to parse it
-                            try:
-                                parsed_count = int(pd.to_numeric(cell_count_value_str, errors='raise'))
-                                if parsed_count < 0:
-                                    logger.warning(f"load_csv_to_db: Negative cell count ({parsed_count}) for sample '{sample_id}', population '{pop_col_name}'. Storing as NULL.")
-                                    # count_to_insert remains None
-                                else:
-                                    count_to_insert = parsed_count
-                            except (ValueError, TypeError):
-                                logger.warning(f"load_csv_to_db: Invalid cell count value ('{cell_count_value_str}') for sample '{sample_id}', population '{pop_col_name}'. Storing as NULL.")
-                                # count_to_insert remains None
-                        # If cell_count_value_str was empty, count_to_insert is already None.
-                    # else: column not in CSV row, count_to_insert remains None
-                    logger.debug(f"load_csv_to_db: For sample '{sample_id}', population '{pop_col_name}', determined count_to_insert: {count_to_insert} (Original CSV: '{row.get(pop_col_name)}')")
-                    
-                    # Always attempt to insert, using None for count if it was missing, empty, or invalid
-                    c.execute('''
-                        INSERT OR REPLACE INTO cell_counts (id, sample_id, population, count)
-                        VALUES (?, ?, ?, ?)
-                    ''', (str(uuid4()), sample_id, pop_col_name, count_to_insert))
-                    # No c.rowcount check needed here for counts_added as it's initial load
-            except Exception as e:
-                logger.error(f"load_csv_to_db: Error processing row: {row.to_dict()}. Error: {e}")
-                continue
-        processed_rows += len(chunk_df)
-        conn.commit()
-        logger.info(f"load_csv_to_db: Committed chunk. Total rows processed so far: {processed_rows}")
+    conn = connect(db_file)
+    try:
+        c = conn.cursor()
+
+        # The whole file loads in one transaction: one journal flush at the end instead of one per chunk
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            logger.info(f"load_csv_to_db: Loading CSV '{csv_file}' in chunks of {chunk_size}.")
+            start_time = datetime.now()
+
+            processed_rows = 0
+            loaded_chunks = []
+            chunks = _prefetched(_read_csv_chunks(csv_file, chunk_size))
+            for chunk_df in chunks:
+                logger.info(f"load_csv_to_db: Processing chunk {processed_rows // chunk_size + 1} with {len(chunk_df)} rows.")
+                if CSV_SAMPLE_ID_COLUMN != 'sample_id' and CSV_SAMPLE_ID_COLUMN in chunk_df.columns:
+                    chunk_df = chunk_df.rename(columns={CSV_SAMPLE_ID_COLUMN: 'sample_id'})
+                loaded_chunks.append(chunk_df)
+
+                valid_rows_df, _ = _rows_with_sample_id(chunk_df, 'load_csv_to_db')
+                # Every expected population gets a cell_counts row; populations absent from the CSV are stored as NULL
+                missing_populations = [pop for pop in EXPECTED_CELL_POPULATIONS if pop not in valid_rows_df.columns]
+                valid_rows_df = valid_rows_df.assign(**{pop: "" for pop in missing_populations})
+
+                # Rows are built column-wise and inserted with one executemany per table
+                sample_rows = _build_sample_rows(valid_rows_df, 'load_csv_to_db')
+                cell_count_rows = _build_cell_count_rows(valid_rows_df, EXPECTED_CELL_POPULATIONS, 'load_csv_to_db')
+                logger.debug("load_csv_to_db: Built %d sample rows and %d cell count rows for chunk.", len(sample_rows), len(cell_count_rows))
+                # All samples go in before their cell counts, so a replaced sample's cascade cannot remove the new counts
+                c.executemany(LOAD_SAMPLE_SQL, sample_rows)
+                c.executemany(LOAD_CELL_COUNT_SQL, cell_count_rows)
+                processed_rows += len(chunk_df)
+                logger.info(f"load_csv_to_db: Inserted chunk. Total rows processed so far: {processed_rows}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        conn.close()
+    # No-op when the indexes already exist; builds them in one pass when init_db deferred them
+    create_secondary_indexes(db_file)
 
     logger.info(f"load_csv_to_db: Finished loading. Total rows processed: {processed_rows}")
     logger.info(f"load_csv_to_db: Total time taken: {datetime.now() - start_time}")
-    
-    # Cache the final DataFrame
-    cache_dataframe(chunk_df, cache_key, expire_seconds=3600)
-    
-    return chunk_df
-    conn.close()
-
-def append_csv_to_db(db_file, uploaded_file_object, chunk_size=1000):
+
+    # Cache the whole loaded DataFrame, not just the last chunk
+    loaded_df = pd.concat(loaded_chunks, ignore_index=True) if loaded_chunks else pd.DataFrame()
+    cache_dataframe(loaded_df, cache_key, expire_seconds=3600)
+
+    return loaded_df
+
+def _append_writer(db_file, batches, commit_every, result):
+    """
+    Writer thread for append_csv_to_db: inserts (sample_rows, cell_count_rows, row_count) batches from the
+    queue in one transaction. None commits and ends the append; ABORT_APPEND rolls it back. Counters and
+    any exception are reported through result.
+    """
+    conn = None
+    finished = False
+    try:
+        conn = connect(db_file)
+        c = conn.cursor()
+        conn.execute('BEGIN IMMEDIATE')
+        rows_since_commit = 0
+        while True:
+            batch = batches.get()
+            if batch is None or batch is ABORT_APPEND:
+                finished = True
+                if batch is None:
+                    conn.commit()
+                else:
+                    conn.rollback()
+                break
+            sample_rows, cell_count_rows, row_count = batch
+            c.executemany(APPEND_SAMPLE_SQL, sample_rows)
+            result['samples_added'] += c.rowcount
+            result['samples_skipped_existing'] += len(sample_rows) - c.rowcount # Assumed skipped due to existing PK
+            c.executemany(APPEND_CELL_COUNT_SQL, cell_count_rows)
+            # executemany sums rowcount over all rows, counting NULL and numeric counts alike
+            result['cell_counts_added'] += c.rowcount
+            rows_since_commit += row_count
+            if commit_every and rows_since_commit >= commit_every:
+                conn.commit()
+                conn.execute('BEGIN IMMEDIATE')
+                rows_since_commit = 0
+                logger.info("append_csv_to_db: Committed batch.")
+    except Exception as e:
+        result['error'] = e
+        if conn is not None:
+            conn.rollback()
+        # Keep consuming so the parsing thread never blocks on a full queue
+        while not finished:
+            batch = batches.get()
+            finished = batch is None or batch is ABORT_APPEND
+    finally:
+        if conn is not None:
+            conn.close()
+
+def _read_fraction(file_object):
+    """Returns how far into file_object reading has got (0.0-1.0), or None when its size is unknown."""
+    try:
+        size = getattr(file_object, 'size', None) or os.fstat(file_object.fileno()).st_size
+        return min(file_object.tell() / size, 1.0) if size else None
+    except Exception:
+        return None
+
+def append_csv_to_db(db_file, uploaded_file_object, chunk_size=1000, commit_every=None, progress_callback=None):
+    # The whole append runs in one transaction; pass commit_every=N to commit after every N processed rows instead.
+    # progress_callback, if given, is called after each chunk with the fraction of the file read so far (or None)
     # Use file object name and last modified time (if available) in cache key
     file_name_for_logging = getattr(uploaded_file_object, 'name', 'N/A')
     try:
@@ -147,125 +329,57 @@ def append_csv_to_db(db_file, uploaded_file_object, chunk_size=1000):
     else:
         logger.info("append_csv_to_db: Cache miss or invalid cache, loading from uploaded CSV.")
 
-    conn = sqlite3.connect(db_file)
-    c = conn.cursor()
     logger.info(f"append_csv_to_db: Starting to append CSV data from '{file_name_for_logging}' in chunks of {chunk_size}.")
 
     rows_processed = 0
-    samples_added_count = 0
-    samples_skipped_existing_count = 0
-    cell_counts_added_count = 0
     rows_with_errors_count = 0
 
+    # Parsing stays on this thread while a writer thread inserts the previous chunks
+    batches = queue.Queue(maxsize=APPEND_QUEUE_MAXSIZE)
+    writer_result = {'samples_added': 0, 'samples_skipped_existing': 0, 'cell_counts_added': 0}
+    writer = threading.Thread(target=_append_writer, args=(db_file, batches, commit_every, writer_result),
+                              name='append_csv_writer', daemon=True)
+    writer.start()
+
     try:
-        for chunk_df in pd.read_csv(uploaded_file_object, chunksize=chunk_size, na_filter=False):
-            if CSV_SAMPLE_ID_COLUMN != 'sample_id' and CSV_SAMPLE_ID_COLUMN in chunk_df.columns:
-                chunk_df = chunk_df.rename(columns={CSV_SAMPLE_ID_COLUMN: 'sample_id'})
-            logger.info(f"append_csv_to_db: Processing chunk {rows_processed // chunk_size + 1} with {len(chunk_df)} rows.")
-            
-            # Determine which cell population columns are actually in this chunk
-            relevant_cell_cols_in_chunk = [col for col in EXPECTED_CELL_POPULATIONS if col in chunk_df.columns]
-
-            for _, row in chunk_df.iterrows():
-                rows_processed += 1
-                current_sample_id_from_csv = "<UNKNOWN_SAMPLE_ID>" # For logging in case of early error
-                try:
-                    # 1. Extract and validate sample_id (from CSV 'sample' column)
-                    current_sample_id_from_csv = str(row[CSV_SAMPLE_ID_COLUMN]).strip() if CSV_SAMPLE_ID_COLUMN in row and str(row[CSV_SAMPLE_ID_COLUMN]).strip() != "" else None
-                    if not current_sample_id_from_csv:
-                        logger.warning(f"append_csv_to_db: Skipping row {rows_processed} due to missing or empty sample_id. Data: {row.to_dict()}")
-                        rows_with_errors_count += 1
-                        continue
-
-                    # 2. Prepare sample_data_for_db (dictionary with DB column names as keys)
-                    sample_data_for_db = {'sample_id': current_sample_id_from_csv}
-                    for db_col_name in EXPECTED_SAMPLE_COLUMNS:
-                        if db_col_name == 'sample_id': # Already handled
-                            continue
-                        
-                        # Assume CSV column name is the same as DB column name for other metadata
-                        csv_col_name = db_col_name 
-                        if csv_col_name in row and str(row[csv_col_name]).strip() != "":
-                            value = str(row[csv_col_name]).strip()
-                            if db_col_name == 'age':
-                                try: sample_data_for_db[db_col_name] = int(pd.to_numeric(value, errors='raise'))
-                                except (ValueError, TypeError): 
-                                    logger.warning(f"append_csv_to_db: Invalid age '{value}' for sample '{current_sample_id_from_csv}'. Storing as NULL.")
-                                    sample_data_for_db[db_col_name] = None
-                            elif db_col_name == 'time_from_treatment_start':
-                                try: sample_data_for_db[db_col_name] = int(pd.to_numeric(value, errors='raise'))
-                                except (ValueError, TypeError): 
-                                    logger.warning(f"append_csv_to_db: Invalid time_from_treatment_start '{value}' for sample '{current_sample_id_from_csv}'. Storing as NULL.")
-                                    sample_data_for_db[db_col_name] = None
-                            elif db_col_name == 'condition':
-                                sample_data_for_db[db_col_name] = value.lower()
-                            else:
-                                sample_data_for_db[db_col_name] = value
-                        else:
-                            sample_data_for_db[db_col_name] = None # If CSV col missing or empty string, store as NULL
-
-                    # 3. Build column list and value tuple for SQL INSERT into 'samples' table
-                    db_cols_for_sql_insert = []
-                    db_values_for_sql_list = []
-                    for col_name_in_order in EXPECTED_SAMPLE_COLUMNS: # Iterate to maintain defined column order
-                        db_cols_for_sql_insert.append(col_name_in_order)
-                        db_values_for_sql_list.append(sample_data_for_db.get(col_name_in_order)) # .get() is safer, defaults to None
-                    
-                    db_values_for_sql_tuple = tuple(db_values_for_sql_list)
-                    
-                    c.execute(f'''
-                        INSERT OR IGNORE INTO samples ({', '.join(db_cols_for_sql_insert)})
-                        VALUES ({', '.join(['?'] * len(db_cols_for_sql_insert))})
-                    ''', db_values_for_sql_tuple)
-
-                    if c.rowcount > 0:
-                        samples_added_count += 1
-                    else:
-                        samples_skipped_existing_count += 1 # Assumed skipped due to existing PK
-
-                    # 4. Insert cell counts for the current sample
-                    for pop_col_name in relevant_cell_cols_in_chunk: # Iterate only over cell populations present in CSV
-                        cell_count_value_str = str(row[pop_col_name]).strip()
-                        count_to_insert = None # Default to NULL
-
-                        if cell_count_value_str != "": # If CSV cell count is not an empty string, try to parse it
-                            try:
-                                parsed_count = int(pd.to_numeric(cell_count_value_str, errors='raise'))
-                                if parsed_count < 0:
-                                    logger.warning(f"append_csv_to_db: Negative cell count ({parsed_count}) for sample '{current_sample_id_from_csv}', population '{pop_col_name}'. Storing as NULL.")
-                                    # count_to_insert remains None (or you could choose to skip: continue)
-                                else:
-                                    count_to_insert = parsed_count
-                            except ValueError:
-                                logger.warning(f"append_csv_to_db: Invalid cell count value ('{cell_count_value_str}') for sample '{current_sample_id_from_csv}', population '{pop_col_name}'. Storing as NULL.")
-                                # count_to_insert remains None
-                        # If cell_count_value_str was empty, count_to_insert is already None.
-                        
-                        # Always attempt to insert, using None for count if it was empty or invalid
-                        c.execute('''
-                            INSERT OR IGNORE INTO cell_counts (id, sample_id, population, count)
-                            VALUES (?, ?, ?, ?)
-                        ''', (str(uuid4()), current_sample_id_from_csv, pop_col_name, count_to_insert))
-                        
-                        # We count additions based on c.rowcount, regardless of whether count was NULL or a number
-                        if c.rowcount > 0:
-                            cell_counts_added_count += 1
-                        # No explicit error count increment here unless c.execute itself fails (caught by outer try-except)
+        try:
+            for chunk_df in _read_csv_chunks(uploaded_file_object, chunk_size):
+                if 'error' in writer_result:
+                    break # The writer has failed and rolled back; stop parsing
+                if CSV_SAMPLE_ID_COLUMN != 'sample_id' and CSV_SAMPLE_ID_COLUMN in chunk_df.columns:
+                    chunk_df = chunk_df.rename(columns={CSV_SAMPLE_ID_COLUMN: 'sample_id'})
+                logger.info(f"append_csv_to_db: Processing chunk {rows_processed // chunk_size + 1} with {len(chunk_df)} rows.")
                 
-                except Exception as e_row:
-                    logger.error(f"append_csv_to_db: Error processing row {rows_processed} for sample_id '{current_sample_id_from_csv}': {e_row}. Row data: {row.to_dict()}")
-                    rows_with_errors_count += 1
-                    continue # to next row in chunk_df
-            
-            conn.commit()
-            logger.info(f"append_csv_to_db: Committed chunk. Total rows processed so far: {rows_processed}")
+                rows_processed += len(chunk_df)
+                # Determine which cell population columns are actually in this chunk
+                relevant_cell_cols_in_chunk = [col for col in EXPECTED_CELL_POPULATIONS if col in chunk_df.columns]
+
+                # 1. Validate sample_id (the CSV 'sample' column, renamed to 'sample_id' above) for the whole chunk
+                valid_rows_df, missing_id_count = _rows_with_sample_id(chunk_df, 'append_csv_to_db')
+                rows_with_errors_count += missing_id_count
+
+                # 2./3. Build the 'samples' rows column-wise; 4. parse the cell counts of the same rows column-wise
+                sample_rows = _build_sample_rows(valid_rows_df, 'append_csv_to_db')
+                cell_count_rows = _build_cell_count_rows(valid_rows_df, relevant_cell_cols_in_chunk, 'append_csv_to_db')
+                batches.put((sample_rows, cell_count_rows, len(chunk_df)))
+                if progress_callback is not None:
+                    progress_callback(_read_fraction(uploaded_file_object))
+            batches.put(None)
+        except BaseException:
+            batches.put(ABORT_APPEND)
+            raise
+        finally:
+            writer.join()
+
+        if 'error' in writer_result:
+            raise writer_result['error']
 
         summary_details = {
             'file_name': file_name_for_logging,
             'rows_processed': rows_processed,
-            'samples_added': samples_added_count,
-            'samples_skipped_existing': samples_skipped_existing_count,
-            'cell_counts_added': cell_counts_added_count,
+            'samples_added': writer_result['samples_added'],
+            'samples_skipped_existing': writer_result['samples_skipped_existing'],
+            'cell_counts_added': writer_result['cell_counts_added'],
             'rows_with_errors': rows_with_errors_count
         }
         log_operation(db_file, 'append_csv_data', details=json.dumps(summary_details)) # Log details as JSON string
@@ -277,8 +391,4 @@ def append_csv_to_db(db_file, uploaded_file_object, chunk_size=1000):
         return False, {"error": "Uploaded CSV file is empty."}
     except Exception as e_main:
         logger.error(f"append_csv_to_db: Failed to append CSV data. Error: {e_main}", exc_info=True)
-        conn.rollback()
         return False, {"error": str(e_main)}
-    finally:
-        if conn:
-            conn.close()
@@ -1,100 +1,122 @@
-import sqlite3
+import json
 import pandas as pd
 import logging
 import streamlit as st
 
+from .connection_manager import get_connection
+
 logger = logging.getLogger(__name__)
 
-@st.cache_data
+SAMPLE_COLUMNS = ['sample_id', 'project', 'subject', 'condition', 'age', 'sex', 'treatment', 'response', 'sample_type', 'time_from_treatment_start']
+SAMPLE_COLUMNS_SQL = ', '.join(f"s.{col}" for col in SAMPLE_COLUMNS)
+EXPECTED_CELL_COLUMNS = ['b_cell', 'cd4_t_cell', 'cd8_t_cell', 'monocyte', 'nk_cell']
+
+# One MAX(CASE ...) per population pivots the counts inside SQLite, which returns one row per sample
+CELL_COUNT_COLUMNS_SQL = ',\n'.join(
+    f"MAX(CASE WHEN c.population = '{population}' THEN c.count END) AS {population}"
+    for population in EXPECTED_CELL_COLUMNS
+)
+
+def _fetch_wide_data(conn, where_clause="", params=()):
+    """
+    Returns one row per sample (matching where_clause on samples s) with one count column per expected population.
+    The inner join leaves out samples without any cell_counts rows.
+    """
+    query = f'''
+        SELECT {SAMPLE_COLUMNS_SQL},
+               {CELL_COUNT_COLUMNS_SQL}
+        FROM samples s
+        JOIN cell_counts c ON s.sample_id = c.sample_id
+        {where_clause}
+        GROUP BY s.sample_id
+        ORDER BY s.sample_id
+    '''
+    df = pd.read_sql_query(query, conn, params=params)
+    # Counts stay float, as the callers and the analysis code expect
+    df[EXPECTED_CELL_COLUMNS] = df[EXPECTED_CELL_COLUMNS].astype(float)
+    return df
+
+# Shared across sessions; the UI clears it after every write and the TTL bounds staleness from writes made elsewhere
+@st.cache_data(ttl=3600, show_spinner=False)
 def get_distinct_values(db_file, column_name, table_name='samples'):
-    conn = sqlite3.connect(db_file)
-    try:
-        query = f"SELECT DISTINCT {column_name} FROM {table_name} WHERE {column_name} IS NOT NULL ORDER BY {column_name}"
-        df = pd.read_sql_query(query, conn)
-        return df[column_name].tolist()
-    finally:
-        conn.close()
+    conn = get_connection(db_file)
+    query = f"SELECT DISTINCT {column_name} FROM {table_name} WHERE {column_name} IS NOT NULL ORDER BY {column_name}"
+    # Small metadata result: fetch rows directly instead of going through pd.read_sql_query
+    return [row[0] for row in conn.execute(query).fetchall()]
 
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_distinct_values_bulk(db_file, column_names, table_name='samples'):
+    """
+    Returns {column: sorted distinct non-NULL values} for every column in column_names from one UNION ALL query,
+    instead of one get_distinct_values round-trip per column.
+    """
+    column_names = list(column_names)
+    if not column_names:
+        return {}
+    conn = get_connection(db_file)
+    query = " UNION ALL ".join(
+        f"SELECT {i} AS k, v FROM (SELECT DISTINCT {column} AS v FROM {table_name} WHERE {column} IS NOT NULL)"
+        for i, column in enumerate(column_names)
+    ) + " ORDER BY k, v"
+    values = {column: [] for column in column_names}
+    for k, v in conn.execute(query):
+        values[column_names[k]].append(v)
+    return values
+
+# Cached per filter combination; the UI clears it with get_all_data after every write
+@st.cache_data(show_spinner=False)
 def get_filtered_data(db_file, selected_project=None,
                       selected_condition=None,
                       selected_treatment=None, selected_response=None):
-    conn = sqlite3.connect(db_file)
+    conn = get_connection(db_file)
     try:
-        base_query = '''
-            SELECT 
-                s.sample_id, s.project, s.subject, s.condition, s.age, s.sex,
-                s.treatment, s.response, s.sample_type, s.time_from_treatment_start,
-                c.population, c.count
-            FROM samples s
-            LEFT JOIN cell_counts c ON s.sample_id = c.sample_id
-        '''
         conditions = []
         params = []
+        # Each selection is bound as one JSON array, so the SQL text only depends on which filters are set
+        # (not on how many values each holds) and stays in the connection's statement cache
+        for column, selected_values in (('project', selected_project), ('condition', selected_condition),
+                                        ('treatment', selected_treatment), ('response', selected_response)):
+            if selected_values:
+                conditions.append(f"s.{column} IN (SELECT value FROM json_each(?))")
+                params.append(json.dumps(list(selected_values)))
+
+        where_clause = " WHERE " + " AND ".join(conditions) if conditions else ""
+        logger.debug(f"Fetching filtered data with conditions: {where_clause} and params: {params}")
+        df = _fetch_wide_data(conn, where_clause, params)
 
-        if selected_project: 
-            placeholders = ','.join(['?'] * len(selected_project))
-            conditions.append(f"s.project IN ({placeholders})")
-            params.extend(selected_project)
-
-        if selected_condition: 
-            placeholders = ','.join(['?'] * len(selected_condition))
-            conditions.append(f"s.condition IN ({placeholders})")
-            params.extend(selected_condition)
-
-        if selected_treatment: 
-            placeholders = ','.join(['?'] * len(selected_treatment))
-            conditions.append(f"s.treatment IN ({placeholders})")
-            params.extend(selected_treatment)
-
-        if selected_response: 
-            placeholders = ','.join(['?'] * len(selected_response))
-            conditions.append(f"s.response IN ({placeholders})")
-            params.extend(selected_response)
-
-        if conditions:
-            query = base_query + " WHERE " + " AND ".join(conditions) + " ORDER BY s.sample_id, c.population"
-        else:
-            query = base_query + " ORDER BY s.sample_id, c.population"
-        
-        logger.debug(f"Executing query: {query} with params: {params}")
-        df = pd.read_sql_query(query, conn, params=params)
-
-        if not df.empty and 'population' in df.columns and 'count' in df.columns:
-            sample_cols = ['sample_id', 'project', 'subject', 'condition', 'age', 'sex', 'treatment', 'response', 'sample_type', 'time_from_treatment_start']
-            # Filter out any sample_cols not actually present in df, though they should be from the SELECT
-            sample_cols_present = [col for col in sample_cols if col in df.columns]
-            
-            if not sample_cols_present or 'sample_id' not in sample_cols_present:
-                logger.error("Critical sample identifier columns missing in get_filtered_data before pivot.")
-                return pd.DataFrame()
-
-            df = df.pivot_table(index=sample_cols_present, columns='population', values='count').reset_index()
-            df = df.fillna(0)
-            
-            expected_cell_cols = ['b_cell', 'cd4_t_cell', 'cd8_t_cell', 'monocyte', 'nk_cell']
-            for col in expected_cell_cols:
-                if col not in df.columns:
-                    df[col] = 0.0 # Ensure float type if other counts are float
-            logger.info(f"get_filtered_data: Pivoted data, {len(df)} rows.")
-            return df
-        elif df.empty:
+        if df.empty:
             logger.info("get_filtered_data: No data returned from SQL query.")
             return pd.DataFrame() # Return empty DataFrame if SQL query returned nothing
-        else: # Not empty, but missing critical columns for pivot
-            logger.warning("get_filtered_data: Data is missing population/count columns for pivot. Returning empty DataFrame.")
-            return pd.DataFrame()
+
+        # As in get_all_data: missing metadata is an empty string, only missing counts become 0
+        df[SAMPLE_COLUMNS] = df[SAMPLE_COLUMNS].fillna('')
+        df = df.fillna(0)
+        logger.info(f"get_filtered_data: Pivoted data, {len(df)} rows.")
+        return df
 
     except Exception as e:
         logger.error(f"Error in get_filtered_data: {e}")
         return pd.DataFrame() # Return empty DataFrame on error
-    finally:
-        conn.close()
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def get_all_sample_ids(db_file):
+    """
+    Returns the sorted non-empty sample_ids of the samples table. ORDER BY sample_id is answered by a scan of the
+    primary-key index, so only the ids are read instead of whole rows through get_all_data.
+    """
+    conn = get_connection(db_file)
+    try:
+        query = "SELECT sample_id FROM samples WHERE TRIM(sample_id) <> '' ORDER BY sample_id"
+        return [row[0] for row in conn.execute(query)]
+    except Exception as e:
+        logger.error(f"Error in get_all_sample_ids: {e}")
+        return []
 
 def get_all_sample_ids_from_samples_table(db_file):
     """
     Retrieves a sorted list of all unique sample_ids directly from the samples table.
     """
-    conn = sqlite3.connect(db_file)
+    conn = get_connection(db_file)
     try:
         query = "SELECT DISTINCT sample_id FROM samples ORDER BY sample_id"
         df = pd.read_sql_query(query, conn)
@@ -126,136 +148,86 @@ def get_all_sample_ids_from_samples_table(db_file):
     except Exception as e:
         logger.error(f"Error in get_all_sample_ids_from_samples_table: {e}")
         return [] # Return an empty list on error
-    finally:
-        conn.close()
 
 
-@st.cache_data
+@st.cache_data(ttl=3600, show_spinner=False)
 def get_all_data(db_file):
-    conn = sqlite3.connect(db_file)
+    conn = get_connection(db_file)
     try:
-        query = '''
-            SELECT 
-                s.sample_id,
-                s.project,
-                s.subject,
-                s.condition,
-                s.age,
-                s.sex,
-                s.treatment,
-                s.response,
-                s.sample_type,
-                s.time_from_treatment_start,
-                c.population,
-                c.count
-            FROM samples s
-            LEFT JOIN cell_counts c ON s.sample_id = c.sample_id
-            ORDER BY s.sample_id, c.population;
-        '''
-        df = pd.read_sql_query(query, conn)
-        logger.info(f"get_all_data: Fetched {len(df)} long-format rows from the database.")
-
-        if not df.empty and 'population' in df.columns and 'count' in df.columns:
-            sample_cols = ['sample_id', 'project', 'subject', 'condition', 'age', 'sex', 'treatment', 'response', 'sample_type', 'time_from_treatment_start']
-            # Filter out any sample_cols not actually present in df
-            sample_cols_present = [col for col in sample_cols if col in df.columns]
-
-            if not sample_cols_present or 'sample_id' not in sample_cols_present:
-                logger.error("Critical sample identifier columns missing in get_all_data before pivot.")
-                return pd.DataFrame()
-
-            # Fill NaN in index columns with a placeholder (e.g., empty string) before pivoting
-            # This prevents rows with NaN in index columns from being dropped by pivot_table
-            logger.debug(f"get_all_data: Columns to be used as index for pivot: {sample_cols_present}")
-            for col in sample_cols_present:
-                if df[col].isnull().any():
-                    logger.debug(f"get_all_data: Filling NaNs in index column '{col}' with empty string before pivot.")
-                    df[col] = df[col].fillna('') 
-
-            df = df.pivot_table(index=sample_cols_present, columns='population', values='count').reset_index()
-            
-            # Now fillna(0) for the numeric cell count columns that were pivoted (and any other NaNs that might have appeared)
-            df = df.fillna(0)
-            
-            expected_cell_cols = ['b_cell', 'cd4_t_cell', 'cd8_t_cell', 'monocyte', 'nk_cell']
-            for col in expected_cell_cols:
-                if col not in df.columns:
-                    df[col] = 0.0 # Ensure float type
-            logger.info(f"get_all_data: Pivoted data, {len(df)} wide-format rows.")
-            return df
-        elif df.empty:
+        df = _fetch_wide_data(conn)
+        if df.empty:
             logger.info("get_all_data: No data returned from SQL query for pivoting.")
             return pd.DataFrame()
-        else: # Not empty, but missing critical columns for pivot
-            logger.warning("get_all_data: Data is missing population/count columns for pivot. Returning empty DataFrame.")
-            return pd.DataFrame()
-
-    except Exception as e:
-        logger.error(f"Error fetching all data: {e}")
-        return pd.DataFrame() # Return an empty DataFrame on error
-    finally:
-        conn.close()
 
-def get_data_for_frequency_table(db_file):
-    conn = sqlite3.connect(db_file)
-    try:
-        df = pd.read_sql_query('''
-            SELECT s.sample_id, c.population, c.count,
-                   SUM(c.count) OVER (PARTITION BY s.sample_id) as total_count
-            FROM samples s
-            JOIN cell_counts c ON s.sample_id = c.sample_id
-        ''', conn)
-        return df
-    finally:
-        conn.close()
+        # Missing sample metadata is shown as an empty string rather than the 0 used for missing counts
+        df[SAMPLE_COLUMNS] = df[SAMPLE_COLUMNS].fillna('')
+        df = df.fillna(0)
 
-def get_data_for_treatment_response_analysis(db_file):
-    conn = sqlite3.connect(db_file)
-    try:
-        df = pd.read_sql_query('''
-            SELECT s.sample_id, s.condition, s.treatment, s.response, s.sample_type,
-                   c.population, c.count,
-                   SUM(c.count) OVER (PARTITION BY s.sample_id) as total_count
-            FROM samples s
-            JOIN cell_counts c ON s.sample_id = c.sample_id
-            WHERE s.condition = 'melanoma' AND s.treatment = 'tr1' AND s.sample_type = 'PBMC'
-        ''', conn)
+        logger.info(f"get_all_data: Pivoted data, {len(df)} wide-format rows.")
         return df
-    finally:
-        conn.close()
 
-def get_data_for_baseline_analysis(db_file):
-    conn = sqlite3.connect(db_file)
-    try:
-        query = '''
-            SELECT s.sample_id, s.project, s.response, s.sex
-            FROM samples s
-            WHERE s.condition = 'melanoma' 
-              AND s.sample_type = 'PBMC' 
-              AND s.time_from_treatment_start = 0
-        '''
-        df = pd.read_sql_query(query, conn)
-        return df
-    finally:
-        conn.close()
+    except Exception as e:
+        logger.error(f"Error fetching all data: {e}")
+        return pd.DataFrame() # Return an empty DataFrame on error
 
-@st.cache_data
-def get_data_for_custom_baseline_query(db_file):
-    conn = sqlite3.connect(db_file)
+# One round-trip for all analysis tabs: every sample with its cell counts
+ANALYSIS_BUNDLE_QUERY = '''
+    SELECT s.sample_id, s.project, s.condition, s.treatment, s.response, s.sex,
+           s.sample_type, s.time_from_treatment_start,
+           c.population, c.count
+    FROM samples s
+    LEFT JOIN cell_counts c ON s.sample_id = c.sample_id
+'''
+
+@st.cache_data(show_spinner=False)
+def get_analysis_bundle(db_file, data_version=None):
+    """
+    Runs ANALYSIS_BUNDLE_QUERY once, adds each sample's total_count and returns the slices used by the analysis tabs:
+    'frequency', 'treatment_response', 'baseline' and 'custom_baseline' DataFrames.
+    data_version is only part of the cache key; pass anything that changes when the database does (writes from
+    other processes never reach this session's clear()). Cleared by the UI alongside get_all_data after every write.
+    """
+    conn = get_connection(db_file)
+    df = pd.read_sql_query(ANALYSIS_BUNDLE_QUERY, conn)
+    logger.info(f"get_analysis_bundle: Fetched {len(df)} rows.")
+
+    # Samples without cell counts only matter for the baseline slices
+    counts_df = df[df['population'].notna()]
+    # The LEFT JOIN makes count float; keep integers when no count is NULL, as the inner join returned
+    if counts_df['count'].notna().all():
+        counts_df = counts_df.astype({'count': 'int64'})
+    # Per-sample totals in one hashed groupby pass, rather than a second join or an SQL window sort
+    counts_df = counts_df.assign(total_count=counts_df.groupby('sample_id', sort=False)['count'].transform('sum'))
+    samples_df = df.drop_duplicates('sample_id')
+
+    treatment_response_mask = ((counts_df['condition'] == 'melanoma') & (counts_df['treatment'] == 'tr1')
+                               & (counts_df['sample_type'] == 'PBMC'))
+    baseline_mask = ((samples_df['condition'] == 'melanoma') & (samples_df['sample_type'] == 'PBMC')
+                     & (samples_df['time_from_treatment_start'] == 0))
+    baseline_columns = ['sample_id', 'project', 'response', 'sex']
+    return {
+        'frequency': counts_df[['sample_id', 'population', 'count', 'total_count']].reset_index(drop=True),
+        'treatment_response': counts_df.loc[treatment_response_mask, [
+            'sample_id', 'condition', 'treatment', 'response', 'sample_type', 'population', 'count', 'total_count'
+        ]].reset_index(drop=True),
+        'baseline': samples_df.loc[baseline_mask, baseline_columns].reset_index(drop=True),
+        'custom_baseline': samples_df.loc[baseline_mask & (samples_df['treatment'] == 'tr1'), baseline_columns].reset_index(drop=True),
+    }
+
+def get_data_for_frequency_table(db_file, data_version=None):
+    return get_analysis_bundle(db_file, data_version)['frequency']
+
+def get_data_for_treatment_response_analysis(db_file, data_version=None):
+    return get_analysis_bundle(db_file, data_version)['treatment_response']
+
+def get_data_for_baseline_analysis(db_file, data_version=None):
+    return get_analysis_bundle(db_file, data_version)['baseline']
+
+def get_data_for_custom_baseline_query(db_file, data_version=None):
     try:
-        query = '''
-            SELECT s.sample_id, s.project, s.response, s.sex
-            FROM samples s
-            WHERE s.condition = 'melanoma' 
-              AND s.sample_type = 'PBMC' 
-              AND s.time_from_treatment_start = 0
-              AND s.treatment = 'tr1'
-        '''
-        df = pd.read_sql_query(query, conn)
+        df = get_analysis_bundle(db_file, data_version)['custom_baseline']
         logger.info(f"get_data_for_custom_baseline_query: Fetched {len(df)} rows.")
         return df
     except Exception as e:
         logger.error(f"Error in get_data_for_custom_baseline_query: {e}")
         return pd.DataFrame()
-    finally:
-        conn.close()
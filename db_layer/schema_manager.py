@@ -1,6 +1,7 @@
-import sqlite3
 import logging
 
+from .connection_manager import connect
+
 logger = logging.getLogger(__name__)
 
 # Expected columns for the samples table (excluding primary key if auto-generated)
@@ -14,9 +15,44 @@ CSV_SAMPLE_ID_COLUMN = 'sample'
 # Expected cell population columns
 EXPECTED_CELL_POPULATIONS = ['b_cell', 'cd8_t_cell', 'cd4_t_cell', 'nk_cell', 'monocyte']
 
-def init_db(db_file):
+# Query-only indexes; a bulk load into empty tables is faster when these are built once afterwards
+SECONDARY_INDEX_STATEMENTS = [
+    'CREATE INDEX IF NOT EXISTS idx_samples_sample_id ON samples (sample_id)',
+    'CREATE INDEX IF NOT EXISTS idx_samples_time_from_treatment_start ON samples (time_from_treatment_start)',
+    # Covering index for the baseline queries: equality filters first, then the projected columns
+    '''
+        CREATE INDEX IF NOT EXISTS idx_samples_baseline ON samples (
+            condition, sample_type, time_from_treatment_start, treatment,
+            sample_id, project, response, sex
+        )
+    ''',
+    'CREATE INDEX IF NOT EXISTS idx_samples_trt_response ON samples (condition, treatment, sample_type)',
+    # Let the filter option queries (SELECT DISTINCT ... ORDER BY) read an index in order instead of sorting the table;
+    # condition is already served by the two indexes above, which lead with it
+    'CREATE INDEX IF NOT EXISTS idx_samples_project ON samples (project)',
+    'CREATE INDEX IF NOT EXISTS idx_samples_treatment ON samples (treatment)',
+]
+
+def _create_secondary_indexes(c):
+    logger.info("create_secondary_indexes: Creating indexes...")
+    for statement in SECONDARY_INDEX_STATEMENTS:
+        c.execute(statement)
+    logger.info("create_secondary_indexes: Indexes created.")
+
+def create_secondary_indexes(db_file):
+    """Creates any missing secondary indexes and refreshes the planner statistics, e.g. after a bulk load."""
+    conn = connect(db_file)
+    try:
+        _create_secondary_indexes(conn.cursor())
+        conn.execute('ANALYZE')
+        conn.commit()
+    finally:
+        conn.close()
+
+def init_db(db_file, create_indexes=True):
+    # Pass create_indexes=False when a bulk load follows; call create_secondary_indexes once it has finished
     logger.info(f"init_db: Connecting to {db_file}")
-    conn = sqlite3.connect(db_file)
+    conn = connect(db_file)
     c = conn.cursor()
     logger.info(f"init_db: Connection and cursor established for {db_file}")
     # Drop existing tables if they exist
@@ -38,23 +74,22 @@ def init_db(db_file):
         )
     ''')
     logger.info("init_db: CREATE TABLE IF NOT EXISTS samples statement executed.")
+    # One count per (sample, population). As the primary key of a WITHOUT ROWID table this is the table's only
+    # B-tree: INSERT OR IGNORE/REPLACE dedupe through it, and its leading sample_id column serves the joins and
+    # the ON DELETE CASCADE lookups, with no separate rowid table or unique index to maintain per insert.
     c.execute('''
         CREATE TABLE cell_counts (
-            id TEXT PRIMARY KEY,
-            sample_id TEXT,
-            population TEXT,
+            sample_id TEXT NOT NULL,
+            population TEXT NOT NULL,
             count INTEGER,
-            FOREIGN KEY (sample_id) REFERENCES samples (sample_id)
-        )
+            PRIMARY KEY (sample_id, population),
+            FOREIGN KEY (sample_id) REFERENCES samples (sample_id) ON DELETE CASCADE
+        ) WITHOUT ROWID
     ''')
     logger.info("init_db: CREATE TABLE IF NOT EXISTS cell_counts statement executed.")
 
-    # Add Indexes
-    logger.info("init_db: Creating indexes...")
-    c.execute('CREATE INDEX IF NOT EXISTS idx_samples_sample_id ON samples (sample_id)')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_samples_time_from_treatment_start ON samples (time_from_treatment_start)')
-    c.execute('CREATE INDEX IF NOT EXISTS idx_cell_counts_sample_id ON cell_counts (sample_id)')
-    logger.info("init_db: Indexes created.")
+    if create_indexes:
+        _create_secondary_indexes(c)
 
     # Create operation_log table
     c.execute('''
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import scipy.stats as stats
 import plotly.express as px
@@ -5,39 +6,48 @@ import plotly.graph_objects as go
 import db_layer as database
 from .cache_manager import cache_dataframe, get_cached_dataframe, invalidate_cache
 
-def calculate_frequency_table(db_file):
-    cache_key = f"freq_table:{db_file}"
+def compute_percentages(df):
+    """Returns count / total_count * 100 rounded to 2 places, computed as one array division (0 where total_count is not positive)."""
+    counts = df['count'].to_numpy(dtype=np.float64)
+    totals = df['total_count'].to_numpy(dtype=np.float64)
+    percentages = np.zeros_like(counts)
+    np.divide(counts, totals, out=percentages, where=totals > 0)
+    return np.round(percentages * 100, 2)
+
+def calculate_frequency_table(db_file, data_version=None):
+    # Pass data_version (anything that changes when the database does) to keep the shared cache entry in step with writes
+    cache_key = f"freq_table:{db_file}" if data_version is None else f"freq_table:{db_file}:{data_version}"
     cached_df = get_cached_dataframe(cache_key)
     if cached_df is not None:
         return cached_df
 
-    df = database.get_data_for_frequency_table(db_file)
+    df = database.get_data_for_frequency_table(db_file, data_version)
     if df.empty or 'count' not in df.columns or 'sample_id' not in df.columns or 'total_count' not in df.columns:
         return pd.DataFrame(columns=['sample_id', 'population', 'count', 'total_count', 'percentage'])
     
-    # Total counts are now pre-calculated in the SQL query
-    # Ensure 'total_count' is not zero to avoid division by zero
-    df['percentage'] = df.apply(lambda row: round(row['count'] / row['total_count'] * 100, 2) if row['total_count'] > 0 else 0, axis=1)
+    # Total counts are pre-calculated per sample by database.get_analysis_bundle
+    df['percentage'] = compute_percentages(df)
     
     result_df = df[['sample_id', 'population', 'count', 'total_count', 'percentage']]
     cache_dataframe(result_df, cache_key, expire_seconds=3600)
     return result_df
 
-def perform_treatment_response_analysis(db_file):
-    cache_key = f"treatment_response:{db_file}"
+def perform_treatment_response_analysis(db_file, data_version=None):
+    # Pass data_version (anything that changes when the database does) to keep the shared cache entry in step with writes
+    cache_key = f"treatment_response:{db_file}" if data_version is None else f"treatment_response:{db_file}:{data_version}"
     cached_result = get_cached_dataframe(cache_key)
     if cached_result is not None:
         return cached_result
 
-    df = database.get_data_for_treatment_response_analysis(db_file)
+    df = database.get_data_for_treatment_response_analysis(db_file, data_version)
     if df.empty:
         return pd.DataFrame(), [], go.Figure()
 
     if 'count' not in df.columns or 'sample_id' not in df.columns or 'total_count' not in df.columns:
         return df, [], go.Figure() # Return original df if critical columns missing for processing
 
-    # Total counts are now pre-calculated in the SQL query
-    df['percentage'] = df.apply(lambda row: round(row['count'] / row['total_count'] * 100, 2) if row['total_count'] > 0 else 0, axis=1)
+    # Total counts are pre-calculated per sample by database.get_analysis_bundle
+    df['percentage'] = compute_percentages(df)
     
     results = []
     fig = go.Figure() # Default empty figure
@@ -72,8 +82,8 @@ def perform_treatment_response_analysis(db_file):
     cache_dataframe((df, results, fig), cache_key, expire_seconds=3600)
     return df, results, fig
 
-def perform_baseline_analysis(db_file):
-    df = database.get_data_for_baseline_analysis(db_file)
+def perform_baseline_analysis(db_file, data_version=None):
+    df = database.get_data_for_baseline_analysis(db_file, data_version)
     if df.empty:
          return {
             'samples_per_project': {},
@@ -90,8 +100,8 @@ def perform_baseline_analysis(db_file):
     }
     return results
 
-def perform_custom_baseline_query_analysis(db_file):
-    df = database.get_data_for_custom_baseline_query(db_file)
+def perform_custom_baseline_query_analysis(db_file, data_version=None):
+    df = database.get_data_for_custom_baseline_query(db_file, data_version)
     if df.empty:
         return {
             'samples_per_project': {},
@@ -1,36 +1,148 @@
 import os
 import json
+import base64
+import zlib
 import pandas as pd
-from typing import Any, Optional, Union
+from typing import Any, Dict, List, Optional, Union
 from datetime import timedelta
 from config.redis_config import redis_config
 from upstash_redis import Redis
 
+# pyarrow is optional: when installed, DataFrames are cached as Arrow IPC streams instead of JSON
+try:
+    import pyarrow as pa
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# orjson is optional: when installed it encodes and parses the cache envelopes several times faster than json
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+def _dumps(obj: Any) -> str:
+    if HAS_ORJSON:
+        # Match json.dumps on int dict keys and additionally accept numpy scalars and arrays
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY).decode('utf-8')
+    return json.dumps(obj)
+
+def _loads(value: Union[str, bytes]) -> Any:
+    # orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers catch either the same way
+    if HAS_ORJSON:
+        return orjson.loads(value)
+    return json.loads(value)
+
 # Initialize Upstash Redis client
 redis_url = os.getenv('UPSTASH_REDIS_URL')
 redis_token = os.getenv('UPSTASH_REDIS_TOKEN')
 # Convert Redis URL to HTTP URL format for Upstash
 http_url = redis_url.replace('redis://', 'https://')
-redis_client = Redis(url=http_url, token=redis_token)
+# The client keeps one pooled keep-alive HTTP connection for its lifetime, so it is created once per process.
+# A failed request is retried quickly rather than after the client's default 3 second pause.
+REDIS_REST_RETRIES = 3
+REDIS_REST_RETRY_INTERVAL = 0.1
+redis_client = Redis(url=http_url, token=redis_token,
+                     rest_retries=REDIS_REST_RETRIES, rest_retry_interval=REDIS_REST_RETRY_INTERVAL)
+
+# Envelopes larger than this are stored zlib-compressed; Upstash is reached over HTTPS and billed by bytes
+COMPRESS_MIN_SIZE = 10 * 1024
+COMPRESS_LEVEL = 3
+
+def _compress_envelope(envelope: str) -> str:
+    if len(envelope) < COMPRESS_MIN_SIZE:
+        return envelope
+    compressed = zlib.compress(envelope.encode('utf-8'), COMPRESS_LEVEL)
+    return _dumps({'__codec__': 'zlib', 'data': base64.b64encode(compressed).decode('ascii')})
+
+def _decompress_envelope(obj: dict) -> dict:
+    if obj.get('__codec__') == 'zlib':
+        return _loads(zlib.decompress(base64.b64decode(obj['data'])))
+    return obj
+
+def _dataframe_to_arrow(df: pd.DataFrame) -> str:
+    """Serializes a DataFrame column by column in its native dtypes as a base64 Arrow IPC stream."""
+    table = pa.Table.from_pandas(df)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return base64.b64encode(sink.getvalue().to_pybytes()).decode('ascii')
+
+def _arrow_to_dataframe(data: str) -> pd.DataFrame:
+    return pa.ipc.open_stream(base64.b64decode(data)).read_all().to_pandas()
+
+def _dataframe_to_columns(df: pd.DataFrame) -> Dict[str, Any]:
+    """Serializes a DataFrame column by column, avoiding the object-dtype .values copy of to_json(orient='split')."""
+    return {
+        'index': pd.Series(df.index).to_json(orient='values', date_format='iso'),
+        'columns': list(df.columns),
+        'data': [df.iloc[:, i].to_json(orient='values', date_format='iso') for i in range(df.shape[1])],
+        'dtypes': [str(dtype) for dtype in df.dtypes],
+    }
+
+def _columns_to_dataframe(payload: Dict[str, Any]) -> pd.DataFrame:
+    index = pd.Index(_loads(payload['index']))
+    columns = {}
+    for i, (data, dtype) in enumerate(zip(payload['data'], payload['dtypes'])):
+        column = pd.Series(_loads(data), index=index)
+        try:
+            column = column.astype(dtype)
+        except (TypeError, ValueError):
+            pass  # Keep the parsed values when the dtype cannot be restored (e.g. nullable ints with gaps)
+        columns[i] = column
+    df = pd.DataFrame(columns, index=index)
+    df.columns = payload['columns']
+    return df
 
 class CacheManager:
     def __init__(self):
         """Initialize Upstash Redis client."""
         self.client = redis_client
         
+    def _encode(self, value: Any) -> str:
+        """Serializes a value into the (possibly compressed) JSON envelope stored in Redis."""
+        if isinstance(value, pd.DataFrame):
+            envelope = None
+            if HAS_PYARROW:
+                try:
+                    envelope = {'__type__': 'arrow', 'data': _dataframe_to_arrow(value)}
+                except pa.ArrowException:
+                    pass # e.g. object columns mixing types that Arrow cannot convert; use the column encoding
+            if envelope is None:
+                envelope = {'__type__': 'columns', 'data': _dataframe_to_columns(value)}
+            value = _dumps(envelope)
+        elif isinstance(value, pd.Series):
+            # Convert Series to JSON-compatible format
+            value = _dumps({'__type__': 'series', 'data': value.to_json(orient='split')})
+        else:
+            # Convert other types to JSON
+            value = _dumps({'__type__': 'object', 'data': value})
+        return _compress_envelope(value)
+
+    def _decode(self, value: Any) -> Optional[Union[pd.DataFrame, Any]]:
+        """Inverse of _encode; returns None for a missing key."""
+        if not value:
+            return None
+        try:
+            obj = _decompress_envelope(_loads(value))
+            if obj['__type__'] == 'arrow':
+                return _arrow_to_dataframe(obj['data'])
+            elif obj['__type__'] == 'columns':
+                return _columns_to_dataframe(obj['data'])
+            elif obj['__type__'] == 'dataframe':
+                return pd.read_json(obj['data'], orient='split')
+            elif obj['__type__'] == 'series':
+                return pd.read_json(obj['data'], orient='split', typ='series')
+            else:
+                return obj['data']
+        except json.JSONDecodeError:
+            return value.decode('utf-8')
+
     def set(self, key: str, value: Any, expire_seconds: Optional[int] = None) -> bool:
         """Set a value in Upstash Redis with optional expiration."""
         try:
-            if isinstance(value, pd.DataFrame):
-                # Convert DataFrame to JSON-compatible format
-                value = json.dumps({'__type__': 'dataframe', 'data': value.to_json(orient='split')})
-            elif isinstance(value, pd.Series):
-                # Convert Series to JSON-compatible format
-                value = json.dumps({'__type__': 'series', 'data': value.to_json(orient='split')})
-            else:
-                # Convert other types to JSON
-                value = json.dumps({'__type__': 'object', 'data': value})
-            
+            value = self._encode(value)
             if expire_seconds:
                 self.client.set(key, value, ex=expire_seconds)
             else:
@@ -43,22 +155,36 @@ class CacheManager:
     def get(self, key: str, as_dataframe: bool = False) -> Optional[Union[pd.DataFrame, Any]]:
         """Get a value from Upstash Redis."""
         try:
-            value = self.client.get(key)
-            if value:
-                try:
-                    obj = json.loads(value)
-                    if obj['__type__'] == 'dataframe':
-                        return pd.read_json(obj['data'], orient='split')
-                    elif obj['__type__'] == 'series':
-                        return pd.read_json(obj['data'], orient='split', typ='series')
-                    else:
-                        return obj['data']
-                except json.JSONDecodeError:
-                    return value.decode('utf-8')
-            return None
+            return self._decode(self.client.get(key))
         except Exception as e:
             print(f"Cache get error: {e}")
             return None
+
+    def mget(self, keys: List[str]) -> List[Optional[Union[pd.DataFrame, Any]]]:
+        """Get several values in one MGET round-trip; missing or undecodable keys come back as None."""
+        try:
+            values = self.client.mget(*keys) if keys else []
+        except Exception as e:
+            print(f"Cache mget error: {e}")
+            return [None] * len(keys)
+        results = []
+        for key, value in zip(keys, values):
+            try:
+                results.append(self._decode(value))
+            except Exception as e:
+                print(f"Cache get error for {key}: {e}")
+                results.append(None)
+        return results
+
+    def mset(self, mapping: Dict[str, Any]) -> bool:
+        """Set several values in one MSET round-trip. MSET takes no expiry: use set() for entries that must expire."""
+        try:
+            if mapping:
+                self.client.mset({key: self._encode(value) for key, value in mapping.items()})
+            return True
+        except Exception as e:
+            print(f"Cache mset error: {e}")
+            return False
     
     def delete(self, key: str) -> bool:
         """Delete a key from Upstash Redis."""
@@ -1,21 +1,47 @@
 """
 Handles the generation of PDF reports.
 """
+import functools
+import hashlib
 import io
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.lib.units import inch
-from reportlab.lib import colors
+import threading
+from collections import OrderedDict
+# reportlab is imported inside the functions below: it is only needed once a report is requested,
+# so the app does not pay for the import on every cold start
+import numpy as np
 import pandas as pd
+import plotly.graph_objects as go
 import plotly.io as pio
 
+# Rendered PNGs kept by _render_png, least recently used first out; bounded by total size rather than count
+# because a dense figure at scale 2 can be several MB
+RENDER_CACHE_MAX_BYTES = 32 * 1024 * 1024
+_render_cache = OrderedDict()
+_render_cache_bytes = 0
+_render_cache_lock = threading.Lock()
 
-def df_to_reportlab_table(df):
-    """Converts a pandas DataFrame to a ReportLab Table object."""
-    data = [df.columns.to_list()] + df.values.tolist()
-    table = Table(data)
-    style = TableStyle([
+# Scatter/line traces are thinned to this many points before rendering; Kaleido's cost grows with point count
+# while the PNG at PDF resolution looks the same
+MAX_RENDER_POINTS = 5000
+# Per-point trace attributes that must be thinned together with x and y
+_PER_POINT_ATTRIBUTES = ('x', 'y', 'text', 'hovertext', 'customdata', 'marker.color', 'marker.size', 'marker.symbol')
+
+
+@functools.lru_cache(maxsize=None)
+def _styles():
+    """getSampleStyleSheet builds a fresh set of ParagraphStyles on every call; reports only read from it."""
+    from reportlab.lib.styles import getSampleStyleSheet
+    return getSampleStyleSheet()
+
+# Statistics dicts longer than this are rendered as a table rather than one paragraph per entry
+STATS_TABLE_MIN_ITEMS = 10
+
+@functools.lru_cache(maxsize=None)
+def _table_style():
+    """Shared by every table; built once on first use rather than per call."""
+    from reportlab.lib import colors
+    from reportlab.platypus import TableStyle
+    return TableStyle([
         ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
         ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
         ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
@@ -24,23 +50,82 @@ def df_to_reportlab_table(df):
         ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
         ('GRID', (0, 0), (-1, -1), 1, colors.black)
     ])
-    table.setStyle(style)
-    return table
 
-def fig_to_reportlab_image(fig, width=6*inch):
-    """Converts a Plotly figure to a ReportLab Image object."""
-    img_bytes = pio.to_image(fig, format='png', scale=2) # Increase scale for better resolution
+def df_to_reportlab_table(df):
+    """Converts a pandas DataFrame to a ReportLab Table object."""
+    from reportlab.platypus import Table
+    # itertuples keeps each column's own type instead of upcasting the whole frame to one object array
+    data = [df.columns.to_list()] + [list(row) for row in df.itertuples(index=False, name=None)]
+    return Table(data, style=_table_style())
+
+def _render_png(fig_json, scale):
+    """Renders a figure (given as its JSON) to PNG bytes; memoized because each Kaleido render takes hundreds of ms."""
+    global _render_cache_bytes
+    # Keyed by a digest so the cache holds 32-byte keys instead of the (possibly multi-MB) figure JSON
+    key = (hashlib.blake2b(fig_json.encode('utf-8'), digest_size=32).hexdigest(), scale)
+    with _render_cache_lock:
+        png = _render_cache.get(key)
+        if png is not None:
+            _render_cache.move_to_end(key)
+            return png
+    png = pio.to_image(pio.from_json(fig_json), format='png', scale=scale)
+    with _render_cache_lock:
+        if key not in _render_cache and len(png) <= RENDER_CACHE_MAX_BYTES:
+            _render_cache[key] = png
+            _render_cache_bytes += len(png)
+            while _render_cache_bytes > RENDER_CACHE_MAX_BYTES:
+                _, evicted = _render_cache.popitem(last=False)
+                _render_cache_bytes -= len(evicted)
+    return png
+
+def _point_count(trace):
+    if trace.type not in ('scatter', 'scattergl'):
+        return 0
+    values = trace.y if trace.y is not None else trace.x
+    return len(values) if values is not None else 0
+
+def _downsample_for_render(fig):
+    """Returns fig, or a copy whose dense scatter/line traces keep MAX_RENDER_POINTS evenly spaced points."""
+    if all(_point_count(trace) <= MAX_RENDER_POINTS for trace in fig.data):
+        return fig
+    fig = go.Figure(fig)
+    for trace in fig.data:
+        n_points = _point_count(trace)
+        if n_points <= MAX_RENDER_POINTS:
+            continue
+        keep = np.linspace(0, n_points - 1, MAX_RENDER_POINTS).astype(int)
+        for attribute in _PER_POINT_ATTRIBUTES:
+            values = trace[attribute]
+            # Scalars (a single marker colour, a shared text) apply to every point and are left as they are
+            if values is not None and not isinstance(values, str) and np.ndim(values) > 0 and len(values) == n_points:
+                trace[attribute] = np.asarray(values)[keep]
+    return fig
+
+def fig_to_reportlab_image(fig, width=None):
+    """Converts a Plotly figure to a ReportLab Image object (6 inches wide unless width is given, in points)."""
+    from reportlab.lib.units import inch
+    from reportlab.platypus import Image
+    if width is None:
+        width = 6*inch
+    img_bytes = _render_png(_downsample_for_render(fig).to_json(), 2) # Increase scale for better resolution
     img_file = io.BytesIO(img_bytes)
     img = Image(img_file, width=width, height=width * (fig.layout.height / fig.layout.width if fig.layout.width and fig.layout.height else 0.6))
     return img
 
-def generate_pdf_report(summary_df, plots=None, stats=None, filename="cytometry_report.pdf"):
-    """Generates a PDF report with summary data, plots, and statistics."""
-    buffer = io.BytesIO()
+def generate_pdf_report(summary_df, plots=None, stats=None, filename="cytometry_report.pdf", out_stream=None):
+    """
+    Generates a PDF report with summary data, plots, and statistics.
+    Returns the PDF bytes, or writes the PDF to out_stream (any writable binary file object) and returns None.
+    """
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.units import inch
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table
+
+    buffer = out_stream if out_stream is not None else io.BytesIO()
     doc = SimpleDocTemplate(buffer, pagesize=letter,
                         rightMargin=72, leftMargin=72,
                         topMargin=72, bottomMargin=18)
-    styles = getSampleStyleSheet()
+    styles = _styles()
     story = []
 
     # Title
@@ -50,7 +135,11 @@ def generate_pdf_report(summary_df, plots=None, stats=None, filename="cytometry_
     # Statistics
     if stats:
         story.append(Paragraph("Key Statistics:", styles['h2']))
-        if isinstance(stats, dict):
+        if isinstance(stats, dict) and len(stats) > STATS_TABLE_MIN_ITEMS:
+            # One two-column Table lays out in a single pass instead of one Paragraph parse per statistic
+            story.append(Table([['Metric', 'Value']] + [[str(key), str(value)] for key, value in stats.items()],
+                               style=_table_style()))
+        elif isinstance(stats, dict):
             for key, value in stats.items():
                 story.append(Paragraph(f"<b>{key}:</b> {value}", styles['Normal']))
         elif isinstance(stats, str):
@@ -67,14 +156,17 @@ def generate_pdf_report(summary_df, plots=None, stats=None, filename="cytometry_
     # Plots
     if plots:
         story.append(Paragraph("Plots:", styles['h2']))
+        # Rendered one after another: Kaleido 0.2.x serializes every to_image call through a single shared
+        # subprocess, so a thread pool here would only add overhead
         for i, plot_fig in enumerate(plots):
             if plot_fig:
                 story.append(Paragraph(f"Plot {i+1}: {plot_fig.layout.title.text if plot_fig.layout.title else ''}", styles['h3']))
-                img = fig_to_reportlab_image(plot_fig)
-                story.append(img)
+                story.append(fig_to_reportlab_image(plot_fig))
                 story.append(Spacer(1, 0.2*inch))
     
     doc.build(story)
+    if out_stream is not None:
+        return None
     pdf_bytes = buffer.getvalue()
     buffer.close()
     return pdf_bytes
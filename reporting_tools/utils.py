@@ -1,32 +1,45 @@
 import base64
+import warnings
 from io import BytesIO
 import pandas as pd
 
+# xlsxwriter only writes (no workbook object model to build and serialize), so it is much faster than openpyxl.
+# Its constant_memory mode is not used: pandas writes cells column by column, and that mode only accepts rows in order.
+EXCEL_ENGINE = 'xlsxwriter'
+
 def get_table_download_link(df, filename="data.csv", link_text="Download CSV"):
-    """Generates a link to download a pandas DataFrame as a CSV file."""
-    csv = df.to_csv(index=False)
-    b64 = base64.b64encode(csv.encode()).decode()  # Bytes -> Base64 -> String
+    """
+    Generates a link to download a pandas DataFrame as a CSV file.
+    Deprecated: the base64 data URI is a third larger than the file and is embedded in the page HTML;
+    pass df_to_csv_bytes(df) to st.download_button instead, as the UI does.
+    """
+    warnings.warn("get_table_download_link is deprecated; use st.download_button(data=df_to_csv_bytes(df))",
+                  DeprecationWarning, stacklevel=2)
+    b64 = base64.b64encode(df_to_csv_bytes(df)).decode()  # Bytes -> Base64 -> String
     href = f'<a href="data:file/csv;base64,{b64}" download="{filename}">{link_text}</a>'
     return href
 
 def get_excel_download_link(df, filename="data.xlsx", link_text="Download Excel"):
-    """Generates a link to download a pandas DataFrame as an Excel file."""
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
-        df.to_excel(writer, index=False, sheet_name='Sheet1')
-    excel_data = output.getvalue()
-    b64 = base64.b64encode(excel_data).decode()
+    """
+    Generates a link to download a pandas DataFrame as an Excel file.
+    Deprecated for the same reason as get_table_download_link; use st.download_button(data=df_to_excel_bytes(df)).
+    """
+    warnings.warn("get_excel_download_link is deprecated; use st.download_button(data=df_to_excel_bytes(df))",
+                  DeprecationWarning, stacklevel=2)
+    b64 = base64.b64encode(df_to_excel_bytes(df)).decode()
     href = f'<a href="data:application/vnd.openxmlformats-officedocument.spreadsheetml.sheet;base64,{b64}" download="{filename}">{link_text}</a>'
     return href
 
 
 def df_to_csv_bytes(df):
     """Converts a pandas DataFrame to CSV bytes."""
+    # pandas' writer on purpose: pyarrow's is faster but quotes every string and writes 1.0 as 1,
+    # which would change the downloaded files; repeat downloads are served from the UI's st.cache_data instead
     return df.to_csv(index=False).encode('utf-8')
 
 def df_to_excel_bytes(df):
     """Converts a pandas DataFrame to Excel bytes."""
     output = BytesIO()
-    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+    with pd.ExcelWriter(output, engine=EXCEL_ENGINE) as writer:
         df.to_excel(writer, index=False, sheet_name='Sheet1')
     return output.getvalue()
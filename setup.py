@@ -16,6 +16,8 @@ setup(
         "asyncio==3.4.3",
         "python-dotenv==1.0.0",
         "openpyxl==3.1.2",
+        "xlsxwriter==3.1.9",
+        "orjson==3.9.10",
         "reportlab==4.2.0",
         "kaleido==0.2.1"
     ],
@@ -0,0 +1,35 @@
+import os
+
+import pytest
+
+pytest.importorskip('pandas')
+pytest.importorskip('streamlit')
+
+# reporting_tools.cache_manager builds its Upstash client at import; nothing here reaches Redis
+os.environ.setdefault('UPSTASH_REDIS_URL', 'redis://localhost:6379')
+os.environ.setdefault('UPSTASH_REDIS_TOKEN', 'test-token')
+
+import db_layer as database
+
+
+def test_filtered_data_keeps_missing_metadata_empty(tmp_path):
+    db_file = str(tmp_path / 'cytometry.db')
+    database.init_db(db_file)
+    added, _ = database.add_sample(db_file, {
+        'sample_id': 's1',
+        'project': 'prj1',
+        'condition': 'melanoma',
+        'cell_counts': {'b_cell': 10, 'cd4_t_cell': 5},
+    })
+    assert added
+
+    database.get_filtered_data.clear()
+    df = database.get_filtered_data(db_file, selected_project=['prj1'])
+
+    assert len(df) == 1
+    row = df.iloc[0]
+    for column in ('subject', 'age', 'sex', 'treatment', 'response', 'sample_type', 'time_from_treatment_start'):
+        assert row[column] == '', column
+    assert row['b_cell'] == 10
+    # Populations without a cell_counts row are still reported as 0
+    assert row['cd8_t_cell'] == 0
@@ -1,7 +1,6 @@
 import logging
 import os
 import streamlit as st
-import pandas as pd
 import db_layer as database
 
 logger = logging.getLogger(__name__)
@@ -11,12 +10,52 @@ def initialize_app(db_file, csv_file):
     logger.info(f"Checking for database file: {db_file}")
     if not os.path.exists(db_file):
         logger.info(f"Database file {db_file} not found. Initializing and loading data.")
-        database.init_db(db_file)
+        # Secondary indexes are built by load_csv_to_db after the rows are in, not maintained row by row
+        database.init_db(db_file, create_indexes=False)
         database.load_csv_to_db(db_file, csv_file)
         logger.info(f"Database initialized and data loaded from {csv_file} into {db_file}.")
     else:
         logger.info(f"Database file {db_file} found. Skipping initialization.")
 
+# Columns whose distinct values are kept in session state as 'distinct_<col>s'; the left column's
+# "Add New Sample" form reads 'distinct_projects' and 'distinct_treatments' instead of querying on every rerun
+DISTINCT_VALUE_COLUMNS = ['sample_type', 'treatment', 'project'] # Changed 'cell_type' to 'sample_type' to match CSV
+
+def clear_distinct_values_state():
+    """
+    Drops the session's distinct-value lists (including the sorted sample ids)
+    so the next initialize_session_state reloads them after a write.
+    """
+    for col in DISTINCT_VALUE_COLUMNS:
+        st.session_state.pop(f'distinct_{col}s', None)
+    st.session_state.pop('sample_id_options', None)
+
+def sorted_checkpoint_files(db_file):
+    """Returns the checkpoint file names of db_file, newest name first."""
+    return sorted((os.path.basename(p) for p in database.list_db_checkpoints(db_file)), reverse=True)
+
+def refresh_after_mutation(db_file, changed_columns=(), full=False):
+    """
+    Clears the shared query caches after a write and reloads only the session state it can have changed:
+    the distinct values of changed_columns and the sample id list. full=True (bulk appends, reverts) also
+    reloads every distinct-value list and 'all_samples_df'; single-sample writes patch that frame themselves.
+    """
+    database.get_all_data.clear()
+    database.get_distinct_values.clear()
+    database.get_distinct_values_bulk.clear()
+    database.get_filtered_data.clear()
+    database.get_analysis_bundle.clear()
+    database.get_operation_log.clear()
+    database.get_all_sample_ids.clear()
+    if full:
+        clear_distinct_values_state()
+        st.session_state.all_samples_df = database.get_all_data(db_file)
+    else:
+        for col in changed_columns:
+            st.session_state.pop(f'distinct_{col}s', None)
+        st.session_state.pop('sample_id_options', None)
+    initialize_session_state(db_file)
+
 def initialize_session_state(db_file):
     """Initializes Streamlit session state variables."""
     logger.info("Initializing session state...")
@@ -24,30 +63,28 @@ def initialize_session_state(db_file):
         st.session_state.all_samples_df = database.get_all_data(db_file)
         logger.info("Initial 'all_samples_df' loaded into session state.")
 
-    filter_columns = ['sample_type', 'treatment'] # Changed 'cell_type' to 'sample_type' to match CSV
-    for col in filter_columns:
-        state_key = f'distinct_{col}s'
-        if state_key not in st.session_state:
-            try:
-                values = database.get_distinct_values(db_file, col)
-                if col in []: # No numeric columns left here for now
-                    try:
-                        numeric_values = sorted(list(set(pd.to_numeric(values, errors='coerce').dropna().unique())))
-                        st.session_state[state_key] = numeric_values
-                    except Exception: # Fallback to string sort if conversion fails
-                        st.session_state[state_key] = sorted(list(set(values)))
-                else:
-                    st.session_state[state_key] = sorted(list(set(values)))
-                logger.info(f"Loaded distinct values for '{col}' into session state.")
-            except Exception as e:
-                logger.error(f"Failed to load distinct values for '{col}': {e}")
-                st.session_state[state_key] = []
-
-    if 'confirm_removal_sample_id' not in st.session_state:
-        st.session_state.confirm_removal_sample_id = None
-    if 'confirm_removal_sample_id_target' not in st.session_state:
-        st.session_state.confirm_removal_sample_id_target = None
-    if 'show_revert_confirmation' not in st.session_state:
-        st.session_state.show_revert_confirmation = False
+    if 'sample_id_options' not in st.session_state:
+        st.session_state.sample_id_options = database.get_all_sample_ids(db_file)
+
+    missing_columns = [col for col in DISTINCT_VALUE_COLUMNS if f'distinct_{col}s' not in st.session_state]
+    if missing_columns:
+        try:
+            # One query for every missing column; the values come back de-duplicated and sorted by SQLite
+            distinct_values = database.get_distinct_values_bulk(db_file, tuple(missing_columns))
+            for col in missing_columns:
+                st.session_state[f'distinct_{col}s'] = distinct_values[col]
+            logger.info(f"Loaded distinct values for {missing_columns} into session state.")
+        except Exception as e:
+            logger.error(f"Failed to load distinct values for {missing_columns}: {e}")
+            for col in missing_columns:
+                st.session_state[f'distinct_{col}s'] = []
+
+    if 'checkpoint_files' not in st.session_state:
+        st.session_state.checkpoint_files = sorted_checkpoint_files(db_file)
+
+    # UI flags get their defaults here, once, so the left column can read them without guarding every rerun
+    for key, default in (('confirm_removal_sample_id', None), ('confirm_removal_sample_id_target', None),
+                         ('show_revert_confirmation', False), ('selected_checkpoint_to_revert', None)):
+        st.session_state.setdefault(key, default)
 
     logger.info("Session state initialization complete.")
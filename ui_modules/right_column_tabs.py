@@ -1,194 +1,312 @@
+import os
+import numpy as np
 import streamlit as st
 import pandas as pd
 import plotly.express as px
+import plotly.io as pio
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 from datetime import datetime
 from reporting_tools import utils
 from reporting_tools import analysis
 from reporting_tools import reporting # Added for PDF reporting
+from reporting_tools.cache_manager import HAS_ORJSON
 import plotly.express as px # Ensure px is available for potential plot generation for PDF
 
+# st.plotly_chart serializes every figure with plotly.io's JSON engine on each rerun; orjson encodes
+# the numeric trace arrays natively and is much faster than the default json engine
+if HAS_ORJSON:
+    pio.json.config.default_engine = 'orjson'
+
+# PDF reports are built off the script thread; reportlab and the figure rendering do not touch Streamlit
+_REPORT_EXECUTOR = ThreadPoolExecutor(max_workers=2)
+# How long one script run waits for a pending report before rerunning to check again
+PDF_POLL_SECONDS = 1.0
+
+# Cell population columns in plotting (and legend) order
+CELL_COLS = ('b_cell', 'cd8_t_cell', 'cd4_t_cell', 'nk_cell', 'monocyte')
+# The sample columns a cell population plot can group, place or label by; the rest are left out of the melt
+PLOT_GROUP_COLS = ('project', 'condition', 'treatment', 'response', 'sex', 'sample_type')
+PLOT_ID_COLS = PLOT_GROUP_COLS + ('age', 'subject')
+# Scatter plots with more points than this are rendered with WebGL
+SCATTER_WEBGL_MIN_POINTS = 1000
+
+# Streamlit reruns the script on every widget interaction, and the download buttons need their bytes up front;
+# caching by DataFrame content means an unchanged table is serialized once rather than on every rerun.
+@st.cache_data(show_spinner=False)
+def _cached_csv_bytes(df):
+    return utils.df_to_csv_bytes(df)
+
+@st.cache_data(show_spinner=False)
+def _cached_excel_bytes(df):
+    return utils.df_to_excel_bytes(df)
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _summary_stats(ndf):
+    """The summary metrics of the selection, keyed by label; shared by the metric tiles and the PDF report."""
+    if ndf.empty:
+        return {}
+    stats = {
+        "Total Samples (in selection)": len(ndf),
+        "Unique Subjects (in selection)": ndf['subject'].nunique(),
+        "Average Age (in selection)": f"{ndf['age'].mean():.1f} years",
+        "Gender Distribution (in selection)": f"{ndf['sex'].value_counts().to_dict()}",
+        "Response Rate (in selection)": "N/A",
+    }
+    if 'response' in ndf.columns:
+        # One comparison over the raw array instead of a full value_counts for the single 'y' count
+        responders = np.count_nonzero(ndf['response'].to_numpy() == 'y')
+        stats["Response Rate (in selection)"] = f"{responders / len(ndf) * 100:.1f}%"
+    return stats
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _age_histogram(ages):
+    """The report's age histogram; keyed on the age column alone, so repeated reports of one selection reuse it."""
+    return px.histogram(ages.to_frame(), x='age', title='Age Distribution (in displayed data)')
+
+def _counts_table(counts, key_label, count_label):
+    """Two-column frame of a {value: count} dict, for the baseline count tables."""
+    return pd.DataFrame({key_label: list(counts.keys()), count_label: list(counts.values())})
+
+def _timestamp():
+    """Filename suffix for downloads; taken once per render so the buttons of one page share it."""
+    return datetime.now().strftime('%Y%m%d_%H%M%S')
+
+def _db_version(db_file):
+    """Latest modification time of db_file and its WAL, which changes on every commit from any session."""
+    # Under WAL a commit only appends to the -wal file; the main file changes when a checkpoint copies pages back
+    return max((os.path.getmtime(path) for path in (db_file, f'{db_file}-wal') if os.path.exists(path)), default=0)
+
+# The analysis results are cached per database version, so reruns triggered by unrelated widgets skip the
+# analysis work. The version is also passed down into get_analysis_bundle and the shared Redis keys of the
+# frequency and treatment-response results, so a write from any session is picked up on the next rerun. Old versions age out via max_entries.
+@st.cache_data(show_spinner=False, max_entries=4)
+def _frequency_table(db_file, db_version):
+    return analysis.calculate_frequency_table(db_file, data_version=db_version)
+
+# cache_resource hands back the same Figure instead of unpickling a copy per rerun; the tab only reads it
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _treatment_response(db_file, db_version):
+    return analysis.perform_treatment_response_analysis(db_file, data_version=db_version)
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _baseline_analysis(db_file, db_version):
+    return analysis.perform_baseline_analysis(db_file, data_version=db_version)
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _custom_baseline_query(db_file, db_version):
+    return analysis.perform_custom_baseline_query_analysis(db_file, data_version=db_version)
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def _melt_cells(ndf):
+    """Long-format view of ndf with one row per sample and cell type; only recomputed when the selection changes."""
+    id_cols = [col for col in PLOT_ID_COLS if col in ndf.columns]
+    # The melt repeats every label once per cell type; as categoricals those copies are small integer codes
+    # and Plotly Express groups on the codes. Columns with missing labels stay as strings.
+    categorical = {col: 'category' for col in PLOT_GROUP_COLS if col in ndf.columns and ndf[col].notna().all()}
+    melted = ndf[id_cols + list(CELL_COLS)].astype(categorical).melt(
+        id_vars=id_cols,
+        value_vars=list(CELL_COLS),
+        var_name='Cell Type',
+        value_name='Count'
+    )
+    melted['Cell Type'] = pd.Categorical(melted['Cell Type'], categories=list(CELL_COLS))
+    # Counts are loaded as float64; 32-bit values halve what Plotly Express copies into each trace
+    counts = melted['Count']
+    if counts.notna().all() and (counts % 1 == 0).all() and counts.abs().max() < 2**31:
+        melted['Count'] = counts.astype('int32')
+    else:
+        melted['Count'] = counts.astype('float32')
+    return melted
+
 def render_viewer_summary_tab(display_df, ndf, show_filtered_only):
     st.subheader('Sample Data')
+    ts = _timestamp()
     st.dataframe(display_df)
 
-    if show_filtered_only and not display_df.empty:
-        col1, col2 = st.columns(2, gap="small")
-        with col1:
-            csv_bytes = utils.df_to_csv_bytes(display_df)
-            st.download_button(
-                label="Download CSV (Filtered)",
-                data=csv_bytes,
-                file_name=f"filtered_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                mime="text/csv",
-                key="csv_filtered_viewer"
-            )
-        with col2:
-            excel_bytes = utils.df_to_excel_bytes(display_df)
-            st.download_button(
-                label="Download Excel (Filtered)",
-                data=excel_bytes,
-                file_name=f"filtered_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                key="excel_filtered_viewer"
-            )
-    elif not show_filtered_only and not display_df.empty:
+    if not display_df.empty:
+        # Both views share one pair of buttons; only the labels, file names and widget keys differ
+        label_suffix, name_prefix = ("Filtered", "filtered") if show_filtered_only else ("All", "all")
         col1, col2 = st.columns(2, gap="small")
         with col1:
-            csv_bytes = utils.df_to_csv_bytes(display_df)
+            csv_bytes = _cached_csv_bytes(display_df)
             st.download_button(
-                label="Download CSV (All)",
+                label=f"Download CSV ({label_suffix})",
                 data=csv_bytes,
-                file_name=f"all_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                file_name=f"{name_prefix}_data_{ts}.csv",
                 mime="text/csv",
-                key="csv_all_viewer"
+                key=f"csv_{name_prefix}_viewer"
             )
         with col2:
-            excel_bytes = utils.df_to_excel_bytes(display_df)
+            excel_bytes = _cached_excel_bytes(display_df)
             st.download_button(
-                label="Download Excel (All)",
+                label=f"Download Excel ({label_suffix})",
                 data=excel_bytes,
-                file_name=f"all_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+                file_name=f"{name_prefix}_data_{ts}.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                key="excel_all_viewer"
+                key=f"excel_{name_prefix}_viewer"
             )
 
     st.header('Summary Statistics')
+    summary_stats = _summary_stats(ndf)
     if not ndf.empty:
         summary_col1, summary_col2, summary_col3 = st.columns(3)
         with summary_col1:
-            st.metric("Total Samples (in selection)", len(ndf))
-            st.metric("Unique Subjects (in selection)", ndf['subject'].nunique())
+            st.metric("Total Samples (in selection)", summary_stats["Total Samples (in selection)"])
+            st.metric("Unique Subjects (in selection)", summary_stats["Unique Subjects (in selection)"])
         with summary_col2:
-            st.metric("Average Age (in selection)", f"{ndf['age'].mean():.1f} years" if not ndf['age'].empty else "N/A")
-            st.metric("Gender Distribution (in selection)", f"{ndf['sex'].value_counts().to_dict()}" if not ndf['sex'].empty else "N/A")
+            st.metric("Average Age (in selection)", summary_stats["Average Age (in selection)"])
+            st.metric("Gender Distribution (in selection)", summary_stats["Gender Distribution (in selection)"])
         with summary_col3:
-            if 'response' in ndf.columns and not ndf['response'].empty:
-                response_counts = ndf['response'].value_counts()
-                st.metric("Response Rate (in selection)", 
-                         f"{response_counts.get('y', 0) / len(ndf) * 100:.1f}%" if len(ndf) > 0 else "N/A")
-            else:
-                st.metric("Response Rate (in selection)", "N/A")
+            st.metric("Response Rate (in selection)", summary_stats["Response Rate (in selection)"])
     else:
         st.info("No data in current selection for summary statistics.")
 
     # PDF Report Download Button
     st.markdown("---") # Add a separator
     st.subheader("Download Report")
-    if st.button("Generate PDF Report"): 
+    if st.button("Generate PDF Report") and 'pdf_report_future' not in st.session_state:
+        # The report repeats the metrics shown above
+        if not ndf.empty:
+            report_stats = dict(summary_stats)
+        else:
+            report_stats = {"Summary": "No data in current selection for summary statistics."}
+
+        # For plots, let's try to generate a simple one for demonstration
+        # This could be expanded to include plots from other tabs
+        report_plots = []
+        if not display_df.empty and 'age' in display_df.columns and display_df['age'].nunique() > 1:
+            try:
+                fig_age_dist = _age_histogram(display_df['age'])
+                report_plots.append(fig_age_dist)
+            except Exception as e:
+                st.error(f"Error generating plot for PDF: {e}")
+
+        # Built on a worker thread so the page stays interactive; later reruns pick up the result
+        st.session_state.pdf_report_future = _REPORT_EXECUTOR.submit(
+            reporting.generate_pdf_report,
+            summary_df=display_df,
+            plots=report_plots,
+            stats=report_stats
+        )
+        st.session_state.pdf_report_file_name = f"cytometry_summary_report_{ts}.pdf"
+        st.session_state.pop('pdf_report_bytes', None)
+
+    pdf_future = st.session_state.get('pdf_report_future')
+    if pdf_future is not None:
+        # Wait a moment for the worker, then rerun to look again; the page stays interactive in between
+        # and the download button appears without another click
         with st.spinner("Generating PDF report..."):
-            # Prepare data for the report
-            report_stats = {}
-            if not ndf.empty:
-                report_stats["Total Samples (in selection)"] = len(ndf)
-                report_stats["Unique Subjects (in selection)"] = ndf['subject'].nunique()
-                report_stats["Average Age (in selection)"] = f"{ndf['age'].mean():.1f} years" if not ndf['age'].empty else "N/A"
-                report_stats["Gender Distribution (in selection)"] = f"{ndf['sex'].value_counts().to_dict()}" if not ndf['sex'].empty else "N/A"
-                if 'response' in ndf.columns and not ndf['response'].empty:
-                    response_counts = ndf['response'].value_counts()
-                    report_stats["Response Rate (in selection)"] = f"{response_counts.get('y', 0) / len(ndf) * 100:.1f}%" if len(ndf) > 0 else "N/A"
-                else:
-                    report_stats["Response Rate (in selection)"] = "N/A"
+            try:
+                pdf_bytes = pdf_future.result(timeout=PDF_POLL_SECONDS)
+            except FuturesTimeoutError:
+                pass
+            except Exception as e:
+                # A finished future is dropped either way, so session state no longer holds the report inputs
+                del st.session_state['pdf_report_future']
+                st.error(f"Error generating PDF report: {e}")
             else:
-                report_stats["Summary"] = "No data in current selection for summary statistics."
-
-            # For plots, let's try to generate a simple one for demonstration
-            # This could be expanded to include plots from other tabs
-            report_plots = []
-            if not display_df.empty and 'age' in display_df.columns and display_df['age'].nunique() > 1:
-                try:
-                    fig_age_dist = px.histogram(display_df, x='age', title='Age Distribution (in displayed data)')
-                    report_plots.append(fig_age_dist)
-                except Exception as e:
-                    st.error(f"Error generating plot for PDF: {e}")
-            
-            pdf_bytes = reporting.generate_pdf_report(
-                summary_df=display_df, 
-                plots=report_plots, 
-                stats=report_stats
-            )
-            st.download_button(
-                label="Download PDF Report",
-                data=pdf_bytes,
-                file_name=f"cytometry_summary_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf",
-                mime="application/pdf"
-            )
-            st.success("PDF report generated! Click the button above to download.")
+                del st.session_state['pdf_report_future']
+                st.session_state.pdf_report_bytes = pdf_bytes
+        if 'pdf_report_future' in st.session_state:
+            st.rerun()
+
+    if 'pdf_report_bytes' in st.session_state:
+        st.download_button(
+            label="Download PDF Report",
+            data=st.session_state.pdf_report_bytes,
+            file_name=st.session_state.pdf_report_file_name,
+            mime="application/pdf"
+        )
+        st.success("PDF report generated! Click the button above to download.")
+
+# Widgets inside a fragment rerun only the fragment. st.fragment (st.experimental_fragment from 1.33) is newer
+# than the pinned Streamlit 1.29; there the plots simply rerun with the whole page, as before.
+_fragment = getattr(st, 'fragment', None) or getattr(st, 'experimental_fragment', None) or (lambda func: func)
+
+@_fragment
+def _cell_population_plots(ndf):
+    """Plot type and grouping selectors with the resulting figure; changing them reruns only this block."""
+    plot_type = st.selectbox('Select Plot Type', ['Bar Chart', 'Box Plot', 'Violin Plot', 'Scatter Plot'], key='plot_type_select_tab2')
+    group_by_options = ['None'] + [col for col in PLOT_GROUP_COLS if col in ndf.columns and ndf[col].nunique() > 0]
+    group_by = st.selectbox('Group By', group_by_options, key='plot_group_by_select_tab2')
+
+    plot_df_melted = _melt_cells(ndf)
+    # Every plot colours by its x grouping; pass Plotly only the columns the chosen plot references
+    group_col = group_by if group_by != 'None' else 'Cell Type'
+    plot_input = plot_df_melted[list(dict.fromkeys([group_col, 'Count']))]
+
+    fig = None
+    title_suffix = f"by {group_by.capitalize() if group_by != 'None' else 'Cell Type'}"
+    if plot_type == 'Bar Chart':
+        fig = px.bar(plot_input, x=group_col, y='Count', 
+                     color=group_col, 
+                     barmode='group' if group_by != 'None' else 'relative',
+                     title=f'Cell Counts {title_suffix}', color_discrete_sequence=px.colors.qualitative.Plotly)
+    elif plot_type == 'Box Plot':
+        fig = px.box(plot_input, x=group_col, y='Count', 
+                     color=group_col, 
+                     title=f'Distribution of Cell Counts {title_suffix}', color_discrete_sequence=px.colors.qualitative.Plotly)
+    elif plot_type == 'Violin Plot':
+        fig = px.violin(plot_input, x=group_col, y='Count', 
+                       color=group_col, box=True, 
+                       title=f'Distribution of Cell Counts {title_suffix}', color_discrete_sequence=px.colors.qualitative.Plotly)
+    elif plot_type == 'Scatter Plot' and 'age' in ndf.columns:
+        size_by_count = st.checkbox('Size markers by count', value=True, key='scatter_size_by_count_tab2')
+        scatter_cols = ['age', 'Count', group_col] + [col for col in ('subject', 'sample_type') if col in plot_df_melted.columns]
+        # Above SCATTER_WEBGL_MIN_POINTS the browser draws the markers with WebGL instead of one SVG node each
+        fig = px.scatter(plot_df_melted[list(dict.fromkeys(scatter_cols))], x='age', y='Count', 
+                         color=group_col, size='Count' if size_by_count else None, 
+                         hover_data=['subject', 'sample_type'], title=f'Cell Counts by Age {title_suffix}', 
+                         color_discrete_sequence=px.colors.qualitative.Plotly,
+                         render_mode='webgl' if len(plot_df_melted) > SCATTER_WEBGL_MIN_POINTS else 'svg')
+    elif plot_type == 'Scatter Plot':
+        st.warning("'age' column not available or selected for scatter plot grouping.")
+
+    if fig:
+        fig.update_layout(plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)',
+                          xaxis_title=group_by.capitalize() if group_by != 'None' else 'Cell Type',
+                          yaxis_title='Cell Count', legend_title_text='', height=600)
+        st.plotly_chart(fig, use_container_width=True)
+    elif plot_type == 'Scatter Plot' and 'age' not in ndf.columns:
+        pass 
+    else:
+        st.info("Select plot type and grouping options.")
 
 def render_cell_population_plots_tab(ndf):
     st.header('Cell Population Analysis')
     if not ndf.empty:
-        cell_cols_plot = ['b_cell', 'cd8_t_cell', 'cd4_t_cell', 'nk_cell', 'monocyte']
-        plot_type = st.selectbox('Select Plot Type', ['Bar Chart', 'Box Plot', 'Violin Plot', 'Scatter Plot'], key='plot_type_select_tab2')
-        group_by_options = ['None'] + [col for col in ['project', 'condition', 'treatment', 'response', 'sex', 'sample_type'] if col in ndf.columns and ndf[col].nunique() > 0]
-        group_by = st.selectbox('Group By', group_by_options, key='plot_group_by_select_tab2')
-
-        plot_df_melted = ndf.melt(
-            id_vars=[col for col in ndf.columns if col not in cell_cols_plot],
-            value_vars=cell_cols_plot,
-            var_name='Cell Type',
-            value_name='Count'
-        )
-
-        fig = None
-        title_suffix = f"by {group_by.capitalize() if group_by != 'None' else 'Cell Type'}"
-        if plot_type == 'Bar Chart':
-            fig = px.bar(plot_df_melted, x=group_by if group_by != 'None' else 'Cell Type', y='Count', 
-                         color='Cell Type' if group_by == 'None' else group_by, 
-                         barmode='group' if group_by != 'None' else 'relative',
-                         title=f'Cell Counts {title_suffix}', color_discrete_sequence=px.colors.qualitative.Plotly)
-        elif plot_type == 'Box Plot':
-            fig = px.box(plot_df_melted, x=group_by if group_by != 'None' else 'Cell Type', y='Count', 
-                         color=group_by if group_by != 'None' else 'Cell Type', 
-                         title=f'Distribution of Cell Counts {title_suffix}', color_discrete_sequence=px.colors.qualitative.Plotly)
-        elif plot_type == 'Violin Plot':
-            fig = px.violin(plot_df_melted, x=group_by if group_by != 'None' else 'Cell Type', y='Count', 
-                           color=group_by if group_by != 'None' else 'Cell Type', box=True, 
-                           title=f'Distribution of Cell Counts {title_suffix}', color_discrete_sequence=px.colors.qualitative.Plotly)
-        elif plot_type == 'Scatter Plot' and 'age' in ndf.columns:
-            fig = px.scatter(plot_df_melted, x='age', y='Count', 
-                             color=group_by if group_by != 'None' else 'Cell Type', size='Count', 
-                             hover_data=['subject', 'sample_type'], title=f'Cell Counts by Age {title_suffix}', 
-                             color_discrete_sequence=px.colors.qualitative.Plotly)
-        elif plot_type == 'Scatter Plot':
-            st.warning("'age' column not available or selected for scatter plot grouping.")
-
-        if fig:
-            fig.update_layout(plot_bgcolor='rgba(0,0,0,0)', paper_bgcolor='rgba(0,0,0,0)',
-                              xaxis_title=group_by.capitalize() if group_by != 'None' else 'Cell Type',
-                              yaxis_title='Cell Count', legend_title_text='', height=600)
-            st.plotly_chart(fig, use_container_width=True)
-        elif plot_type == 'Scatter Plot' and 'age' not in ndf.columns:
-            pass 
-        else:
-            st.info("Select plot type and grouping options.")
+        _cell_population_plots(ndf)
     else:
         st.info('No data in current selection for cell population analysis.')
 
 def render_frequency_table_tab(db_file):
     st.header('Frequency Table Analysis (All Data)')
-    freq_table_df = analysis.calculate_frequency_table(db_file)
+    ts = _timestamp()
+    freq_table_df = _frequency_table(db_file, _db_version(db_file))
 
     col1, col2 = st.columns(2)
     with col1:
         st.subheader('Population Distribution')
-        pie_fig = px.pie(freq_table_df, names='population', values='count', title='Population Distribution')
+        # px.pie would ship one value per sample and population and let the browser sum them; send one per slice
+        population_totals = freq_table_df.groupby('population', sort=False, as_index=False)['count'].sum()
+        pie_fig = px.pie(population_totals, names='population', values='count', title='Population Distribution')
         st.plotly_chart(pie_fig, use_container_width=True)
     with col2:
         if not freq_table_df.empty:
             st.dataframe(freq_table_df)
-            csv_bytes = utils.df_to_csv_bytes(freq_table_df)
+            csv_bytes = _cached_csv_bytes(freq_table_df)
             st.download_button(
                 label="Download CSV",
                 data=csv_bytes,
-                file_name=f"frequency_table_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                file_name=f"frequency_table_{ts}.csv",
                 mime="text/csv",
                 key="freq_csv"
             )
-            excel_bytes = utils.df_to_excel_bytes(freq_table_df)
+            excel_bytes = _cached_excel_bytes(freq_table_df)
             st.download_button(
                 label="Download Excel",
                 data=excel_bytes,
-                file_name=f"frequency_table_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+                file_name=f"frequency_table_{ts}.xlsx",
                 mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                 key="freq_excel"
             )
@@ -197,7 +315,7 @@ def render_frequency_table_tab(db_file):
 
 def render_treatment_response_tab(db_file):
     st.header('Treatment Response Analysis (Melanoma, TR1, PBMC)')
-    treatment_df, treatment_results, treatment_fig = analysis.perform_treatment_response_analysis(db_file)
+    treatment_df, treatment_results, treatment_fig = _treatment_response(db_file, _db_version(db_file))
     if not treatment_df.empty:
         st.subheader('Data')
         st.dataframe(treatment_df)
@@ -219,22 +337,17 @@ def render_treatment_response_tab(db_file):
                 else: 
                     not_calculable.append(f"- **{res['population']}**: Significance could not be determined (insufficient data for t-test).")
             
+            # One markdown element per bucket rather than one per population
             if significant_findings:
-                st.markdown("**Significant Differences Observed:**")
-                for finding in significant_findings:
-                    st.markdown(finding)
+                st.markdown("**Significant Differences Observed:**\n\n" + "\n".join(significant_findings))
             else:
                 st.markdown("No cell populations showed a statistically significant difference in this dataset.")
             
             if non_significant_findings:
-                st.markdown("\n**No Significant Differences Observed:**")
-                for finding in non_significant_findings:
-                    st.markdown(finding)
+                st.markdown("**No Significant Differences Observed:**\n\n" + "\n".join(non_significant_findings))
 
             if not_calculable:
-                st.markdown("\n**Could Not Calculate Significance:**")
-                for finding in not_calculable:
-                    st.markdown(finding)
+                st.markdown("**Could Not Calculate Significance:**\n\n" + "\n".join(not_calculable))
         else:
             st.markdown("Statistical analysis results are not available to generate a report.")
     else:
@@ -242,36 +355,39 @@ def render_treatment_response_tab(db_file):
 
 def render_baseline_characteristics_tab(db_file):
     st.header('Baseline Characteristics Analysis (All Data)')
-    baseline_results = analysis.perform_baseline_analysis(db_file)
+    baseline_results = _baseline_analysis(db_file, _db_version(db_file))
     if baseline_results and baseline_results['total_samples'] > 0:
         st.write(f"Total Samples (All Data, Baseline): {baseline_results['total_samples']}")
-        st.write("Samples per project:", baseline_results['samples_per_project'])
-        st.write("Response counts:", baseline_results['response_counts'])
-        st.write("Sex counts:", baseline_results['sex_counts'])
+        for title, counts, key_label in (("Samples per project:", baseline_results['samples_per_project'], 'Project'),
+                                         ("Response counts:", baseline_results['response_counts'], 'Response'),
+                                         ("Sex counts:", baseline_results['sex_counts'], 'Sex')):
+            st.write(title)
+            st.dataframe(_counts_table(counts, key_label, 'Number of Samples'), hide_index=True)
     else:
         st.info("No data for general baseline characteristics analysis.")
 
 def render_custom_baseline_query_tab(db_file):
     st.header('Custom Baseline Query: Melanoma PBMC, TR1, Baseline')
-    custom_baseline_data = analysis.perform_custom_baseline_query_analysis(db_file)
+    ts = _timestamp()
+    custom_baseline_data = _custom_baseline_query(db_file, _db_version(db_file))
     if custom_baseline_data and custom_baseline_data['total_samples'] > 0:
         st.write(f"Total Samples Found: {custom_baseline_data['total_samples']}")
         
         st.subheader("Samples per Project")
         if custom_baseline_data['samples_per_project']:
-            st.table(pd.DataFrame(list(custom_baseline_data['samples_per_project'].items()), columns=['Project', 'Number of Samples']))
+            st.dataframe(_counts_table(custom_baseline_data['samples_per_project'], 'Project', 'Number of Samples'), hide_index=True)
         else:
             st.write("No samples found for any project.")
 
         st.subheader("Responder/Non-Responder Counts")
         if custom_baseline_data['response_counts']:
-            st.table(pd.DataFrame(list(custom_baseline_data['response_counts'].items()), columns=['Response', 'Number of Subjects']))
+            st.dataframe(_counts_table(custom_baseline_data['response_counts'], 'Response', 'Number of Subjects'), hide_index=True)
         else:
             st.write("No response data available.")
 
         st.subheader("Male/Female Counts")
         if custom_baseline_data['sex_counts']:
-            st.table(pd.DataFrame(list(custom_baseline_data['sex_counts'].items()), columns=['Sex', 'Number of Subjects']))
+            st.dataframe(_counts_table(custom_baseline_data['sex_counts'], 'Sex', 'Number of Subjects'), hide_index=True)
         else:
             st.write("No sex data available.")
         
@@ -280,20 +396,20 @@ def render_custom_baseline_query_tab(db_file):
         if not custom_baseline_data['data_summary'].empty:
             col1, col2 = st.columns(2, gap="small")
             with col1:
-                csv_bytes = utils.df_to_csv_bytes(custom_baseline_data['data_summary'])
+                csv_bytes = _cached_csv_bytes(custom_baseline_data['data_summary'])
                 st.download_button(
                     label="Download CSV",
                     data=csv_bytes,
-                    file_name=f"custom_baseline_query_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
+                    file_name=f"custom_baseline_query_{ts}.csv",
                     mime="text/csv",
                     key="cbq_csv"
                 )
             with col2:
-                excel_bytes = utils.df_to_excel_bytes(custom_baseline_data['data_summary'])
+                excel_bytes = _cached_excel_bytes(custom_baseline_data['data_summary'])
                 st.download_button(
                     label="Download Excel",
                     data=excel_bytes,
-                    file_name=f"custom_baseline_query_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx",
+                    file_name=f"custom_baseline_query_{ts}.xlsx",
                     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
                     key="cbq_excel"
                 )